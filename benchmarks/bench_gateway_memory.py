@@ -0,0 +1,140 @@
+"""Resident memory of the gateway caches: the full mode (every intent, members and messages cached) vs LEAN_GATEWAY=1.
+
+Each mode runs in its own process. A bot is built with gateway.gateway_options and
+its connection state is fed the GUILD_CREATE and MESSAGE_CREATE payloads Discord
+would send for those intents: members and presences only with the members and
+presences intents, messages only with the message intents. The RSS growth after
+parsing them is the memory the caches cost. Nothing connects to Discord.
+
+Run from the repository root:
+
+    python benchmarks/bench_gateway_memory.py [guilds] [members per guild] [messages per guild]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+BOT_ID = 1 << 40
+JOINED_AT = "2024-01-01T00:00:00+00:00"
+
+
+def rss_bytes():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmRSS not found; this benchmark needs Linux")
+
+
+def user(user_id):
+    return {"id": str(user_id), "username": f"student{user_id}", "global_name": f"Student {user_id}",
+            "discriminator": "0", "avatar": None}
+
+
+def member(user_id):
+    return {"user": user(user_id), "roles": [], "joined_at": JOINED_AT, "deaf": False, "mute": False, "flags": 0}
+
+
+def guild_create(guild_id, num_members, intents):
+    # Without the members intent Discord only sends the bot's own member
+    member_ids = range(guild_id * 10**6, guild_id * 10**6 + num_members) if intents.members else ()
+    return {
+        "id": str(guild_id),
+        "name": f"Cohort {guild_id}",
+        "member_count": num_members,
+        "large": num_members > 250,
+        "channels": [{"id": str(guild_id + 1), "type": 0, "name": "general", "position": 0}],
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "members": [member(BOT_ID)] + [member(user_id) for user_id in member_ids],
+        "presences": [
+            {"user": {"id": str(user_id)}, "status": "online", "activities": [], "client_status": {"desktop": "online"}}
+            for user_id in member_ids
+        ] if intents.presences else [],
+    }
+
+
+def message_create(guild_id, index, intents):
+    author_id = guild_id * 10**6 + index
+    return {
+        "id": str(guild_id * 10**6 + 500_000 + index),
+        "channel_id": str(guild_id + 1),
+        "guild_id": str(guild_id),
+        "author": user(author_id),
+        "member": {"roles": [], "joined_at": JOINED_AT, "deaf": False, "mute": False, "flags": 0},
+        # Message text is only delivered with the message content intent
+        "content": f"!log {index % 10 + 1} Analysis 2 {index % 100}" if intents.message_content else "",
+        "timestamp": JOINED_AT,
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+async def measure(lean, num_guilds, num_members, num_messages):
+    from discord.ext import commands
+
+    from gateway import gateway_options
+
+    # The defaults of start.py: lean mode leaves the ! prefix commands, and so the message intents, off
+    bot = commands.Bot(command_prefix="!", **gateway_options(lean=lean, prefix_commands=not lean))
+    await bot._async_setup_hook()  # gives the bot its event loop, as Bot.start would
+    state = bot._connection
+    intents = state._intents
+    state._chunk_guilds = False  # members arrive in GUILD_CREATE instead of chunk requests
+    state.parse_ready({"user": user(BOT_ID) | {"bot": True}, "guilds": [], "session_id": "x",
+                       "application": {"id": str(BOT_ID), "flags": 0}})
+    state._ready_task.cancel()
+    del state._ready_state  # handle GUILD_CREATE as if READY had completed
+
+    before = rss_bytes()
+    for guild_id in range(1, num_guilds + 1):
+        guild_id <<= 23
+        state.parse_guild_create(guild_create(guild_id, num_members, intents))
+        if intents.guild_messages:
+            for index in range(num_messages):
+                state.parse_message_create(message_create(guild_id, index, intents))
+    # Let the on_message handlers queued for each message finish, so only the caches remain
+    while len(asyncio.all_tasks()) > 1:
+        await asyncio.sleep(0)
+    after = rss_bytes()
+    members = sum(len(guild._members) for guild in state._guilds.values())
+    messages = len(state._messages) if state._messages is not None else 0
+    return before, after, members, messages
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--mode":
+        lean = sys.argv[2] == "lean"
+        print(*asyncio.run(measure(lean, *map(int, sys.argv[3:6]))))
+        return
+
+    num_guilds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    num_members = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    num_messages = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    print(f"{num_guilds} guilds x {num_members} members, {num_messages} messages per guild")
+    results = {}
+    for mode in ("full", "lean"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, str(num_guilds), str(num_members), str(num_messages)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        before, after, members, messages = map(int, output.split())
+        results[mode] = after
+        print(f"  {mode:5} RSS {after / 2**20:7.1f} MiB (caches +{(after - before) / 2**20:6.1f} MiB)"
+              f"  {members:7} members  {messages:5} messages cached")
+    print(f"  lean mode saves {(results['full'] - results['lean']) / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
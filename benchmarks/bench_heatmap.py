@@ -0,0 +1,77 @@
+"""Compare the /export heatmap renderer with the old pandas Styler implementation.
+
+Run from the repository root:  python benchmarks/bench_heatmap.py
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from heatmap import render_heatmap_html  # noqa: E402
+
+
+def styler_heatmap_html(data, weeks, selected_modules):
+    """The previous generate_html_table body: DataFrame + Styler + a fresh jinja Template per call."""
+    import pandas as pd
+    from jinja2 import Template
+
+    df = pd.DataFrame(data, index=weeks, columns=selected_modules)
+    df = df.round(0).astype(int)
+    template = Template(
+        """
+        <!DOCTYPE html>
+        <html lang="en">
+        <body>
+            <h2>Progress Heatmap</h2>
+            {{ table_html }}
+        </body>
+        </html>
+        """
+    )
+    styled_table = df.style.background_gradient(cmap="coolwarm_r", axis=None)
+    return template.render(table_html=styled_table.to_html())
+
+
+def styler_cell_colors(html):
+    """(background, text colour) per cell in row-major order from Styler's grouped CSS rules."""
+    colors = {}
+    for selectors, background, text_color in re.findall(
+        r"([^{}]+)\{\s*background-color: (#[0-9a-f]{6});\s*color: (#[0-9a-f]{6});\s*\}", html
+    ):
+        for row, col in re.findall(r"_row(\d+)_col(\d+)", selectors):
+            colors[int(row), int(col)] = (background, text_color)
+    return [colors[key] for key in sorted(colors)]
+
+
+def heatmap_cell_colors(html):
+    return re.findall(r"background-color: (#[0-9a-f]{6}); color: (#[0-9a-f]{6});", html)
+
+
+def main():
+    random.seed(0)
+    modules = [f"Module {i}" for i in range(10)]
+    for num_weeks in (5, 20, 100):
+        weeks = [str(week) for week in range(1, num_weeks + 1)]
+        data = [[random.uniform(0, 100) for _ in modules] for _ in weeks]
+
+        old_html = styler_heatmap_html(data, weeks, modules)
+        new_html = render_heatmap_html(data, weeks, modules).decode()
+        old_colors = styler_cell_colors(old_html)
+        new_colors = heatmap_cell_colors(new_html)
+        matching = sum(old == new for old, new in zip(old_colors, new_colors))
+
+        runs = 20
+        old_time = timeit.timeit(lambda: styler_heatmap_html(data, weeks, modules), number=runs) / runs
+        new_time = timeit.timeit(lambda: render_heatmap_html(data, weeks, modules), number=runs) / runs
+        print(
+            f"{num_weeks:>4} sheets x {len(modules)} modules: "
+            f"styler {old_time * 1000:8.2f} ms, heatmap {new_time * 1000:7.2f} ms "
+            f"({old_time / new_time:5.1f}x), colours matching {matching}/{len(old_colors)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
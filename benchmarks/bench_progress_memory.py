@@ -0,0 +1,81 @@
+"""Memory used by progress for 10k users x 20 sheets: nested dicts (the old progress_data) vs ProgressTable.
+
+Run from the repository root:  python benchmarks/bench_progress_memory.py [users] [sheets]
+"""
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from progress_table import ProgressTable  # noqa: E402
+
+MODULES = [
+    "Analysis 2",
+    "Linear Algebra and Numerical Analysis",
+    "Multivariable Calculus and Differential Equations",
+    "Groups and Rings",
+    "Lebesgue Measure and Integration",
+    "Network Science",
+    "Partial Differential Equations in Action",
+    "Probability for Statistics",
+    "Statistical Modelling 1",
+    "Principles of Programming",
+]
+
+
+def make_rows(num_users, num_sheets):
+    """Each user logs 1-3 modules on every sheet, like update_progress would be called."""
+    random.seed(0)
+    rows = []
+    for user_id in range(10**17, 10**17 + num_users):
+        for sheet in range(1, num_sheets + 1):
+            for module in random.sample(MODULES, random.randint(1, 3)):
+                rows.append((user_id, str(sheet), module, float(random.randint(1, 100))))
+    return rows
+
+
+def build_nested_dicts(rows):
+    """The old update_progress layout: every user/sheet pair materialises all modules."""
+    progress_data = {}
+    for user_id, sheet, module, progress in rows:
+        if user_id not in progress_data:
+            progress_data[user_id] = {}
+        if sheet not in progress_data[user_id]:
+            progress_data[user_id][sheet] = {m: 0 for m in MODULES}
+        progress_data[user_id][sheet][module] = progress
+    return progress_data
+
+
+def build_table(rows):
+    table = ProgressTable(MODULES)
+    table.load(rows)
+    return table
+
+
+def measure(build, rows):
+    tracemalloc.start()
+    result = build(rows)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def main():
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_sheets = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rows = make_rows(num_users, num_sheets)
+    # Sheet labels are created once up front in both cases, as they would be when parsed
+    print(f"{num_users} users x {num_sheets} sheets, {len(rows)} logged cells")
+
+    nested, nested_bytes = measure(build_nested_dicts, rows)
+    table, table_bytes = measure(build_table, rows)
+    assert all(table.user_progress(user_id) == nested[user_id] for user_id in list(nested)[:100])
+
+    print(f"  nested dicts   {nested_bytes / 2**20:8.1f} MiB")
+    print(f"  ProgressTable  {table_bytes / 2**20:8.1f} MiB  ({nested_bytes / table_bytes:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""/race chart time vs history length: every log point with a daily tick (before) vs rollups + LTTB + adaptive ticks.
+
+Run from the repository root:  python benchmarks/bench_race.py [users] [days...]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chart_renderer import render_race_png  # noqa: E402
+from race_series import RaceSeries  # noqa: E402
+
+MAX_POINTS = 500  # start.RACE_MAX_POINTS
+LOGS_PER_DAY = 12
+MODULES = ["Analysis 2", "Groups and Rings", "Network Science", "Probability for Statistics"]
+
+
+def previous_render_race_png(series):
+    """The render before rollups: the same figure with a DayLocator tick for every day."""
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    for label, dates, cumulative_progress in series:
+        ax.plot(dates, cumulative_progress, label=label)
+    ax.set_title("Progress Race")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Cumulative Progress (%)")
+    ax.xaxis.set_major_locator(mdates.DayLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d, %Y'))
+    ax.tick_params(axis="x", labelrotation=45)
+    fig.tight_layout()
+    ax.legend(title="Users")
+    ax.grid()
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def make_series(num_users, days, end):
+    random.seed(0)
+    race_series = RaceSeries()
+    start = end - timedelta(days=days)
+    for user_id in range(num_users):
+        for _ in range(days * LOGS_PER_DAY):
+            date = start + timedelta(seconds=random.randrange(days * 86400))
+            race_series.append(user_id, date, random.randint(1, 10), random.choice(MODULES), random.uniform(0, 5))
+    return race_series
+
+
+def timed(render, race_series, end, max_points):
+    began = time.perf_counter()
+    user_data = race_series.query(end_time=end, max_points=max_points)
+    series = [(f"user{user_id}", dates, cumulative) for user_id, (dates, cumulative) in user_data.items()]
+    render(series)
+    points = sum(len(dates) for _, dates, _ in series)
+    return time.perf_counter() - began, points
+
+
+def main():
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    spans = [int(days) for days in sys.argv[2:]] or [7, 30, 120, 365]
+    end = datetime(2026, 6, 1)
+    import matplotlib.figure  # noqa: F401  (imported outside the timings)
+    print(f"{num_users} users, {LOGS_PER_DAY} logs per user per day")
+    print(f"{'days':>6} {'before s':>10} {'points':>9} {'after s':>10} {'points':>9}")
+    for days in spans:
+        race_series = make_series(num_users, days, end)
+        before, before_points = timed(previous_render_race_png, race_series, end, None)
+        after, after_points = timed(render_race_png, race_series, end, MAX_POINTS)
+        print(f"{days:>6} {before:>10.2f} {before_points:>9} {after:>10.2f} {after_points:>9}")
+
+
+if __name__ == "__main__":
+    main()
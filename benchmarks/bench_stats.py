@@ -0,0 +1,66 @@
+"""/stats cost: building the columnar view and cohort stats over every log, then answering from the cache.
+
+Run from the repository root:  python benchmarks/bench_stats.py [users] [logs per user]
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_stats import CohortStats, LogColumns  # noqa: E402
+from race_series import RaceSeries  # noqa: E402
+
+MODULES = [
+    "Analysis 2",
+    "Linear Algebra and Numerical Analysis",
+    "Multivariable Calculus and Differential Equations",
+    "Groups and Rings",
+    "Lebesgue Measure and Integration",
+    "Network Science",
+    "Partial Differential Equations in Action",
+    "Probability for Statistics",
+    "Statistical Modelling 1",
+    "Principles of Programming",
+]
+
+
+def make_series(num_users, logs_per_user, today):
+    """A semester of logs, at random times over the last 120 days."""
+    random.seed(0)
+    race_series = RaceSeries()
+    start = datetime.combine(today, datetime.min.time()) - timedelta(days=120)
+    for user_id in range(num_users):
+        for _ in range(logs_per_user):
+            race_series.append(
+                user_id, start + timedelta(seconds=random.randrange(120 * 86400)),
+                random.randint(1, 10), random.choice(MODULES), float(random.randint(1, 30)),
+            )
+    return race_series
+
+
+def main():
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    logs_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+    today = date(2026, 6, 1)
+    race_series = make_series(num_users, logs_per_user, today)
+
+    began = time.perf_counter()
+    columns = LogColumns(race_series)
+    built_columns = time.perf_counter()
+    stats = CohortStats(columns, today)
+    built_stats = time.perf_counter()
+    for user_id in range(num_users):
+        stats.summary(user_id, f"user{user_id}")
+    answered = time.perf_counter()
+
+    print(f"{num_users} users x {logs_per_user} logs = {len(columns)} log rows")
+    print(f"  columnar view    {(built_columns - began) * 1000:8.1f} ms")
+    print(f"  cohort stats     {(built_stats - built_columns) * 1000:8.1f} ms  (once per data version)")
+    print(f"  one /stats reply {(answered - built_stats) * 1000 / num_users:8.3f} ms  (from the cache)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Load test: drive the bot's slash commands with fake interactions and a local Dropbox stand-in.
+
+start.py is run unchanged in a scratch directory seeded with `users` CSV logs of
+`history` rows each. Dropbox is replaced by a folder on disk (every call sleeps
+--latency seconds, as a network round trip would) and Bot.run by a driver that
+fires --commands random /log, /logmany, /leaderboard, /export, /race,
+/alllogs and /stats calls, --concurrency at a time, then reports per-command
+p50/p99 latency and overall commands/sec.
+
+Run from the repository root:
+
+    python benchmarks/loadtest.py [--users 200] [--history 50] [--commands 1000]
+                                  [--concurrency 20] [--latency 0.05]
+                                  [--mix log=5,logmany=1,leaderboard=2,export=1,race=1,alllogs=1,stats=1]
+                                  [--json results.json] [--verbose]
+
+Nothing connects to Discord or Dropbox.
+"""
+import argparse
+import asyncio
+import csv
+import inspect
+import json
+import os
+import random
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import dropbox  # noqa: E402
+from discord.ext import commands  # noqa: E402
+
+import get_new_dropbox_access_token  # noqa: E402
+
+MODULES = [
+    "Analysis 2",
+    "Linear Algebra and Numerical Analysis",
+    "Multivariable Calculus and Differential Equations",
+    "Groups and Rings",
+    "Lebesgue Measure and Integration",
+    "Network Science",
+    "Partial Differential Equations in Action",
+    "Probability for Statistics",
+    "Statistical Modelling 1",
+    "Principles of Programming",
+]
+FIRST_USER_ID = 10**17
+
+
+class LocalDropbox:
+    """The parts of dropbox.Dropbox the bot uses, backed by a local folder. Each call sleeps `latency` seconds."""
+
+    root = None
+    latency = 0.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _not_found(self, path):
+        return dropbox.exceptions.ApiError("local", f"not_found: {path}", None, None)
+
+    def files_upload(self, content, path, mode=None):
+        time.sleep(self.latency)
+        local_path = self._path(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, "wb") as file:
+            file.write(content)
+
+    def files_download(self, path):
+        time.sleep(self.latency)
+        try:
+            with open(self._path(path), "rb") as file:
+                content = file.read()
+        except (FileNotFoundError, IsADirectoryError):
+            raise self._not_found(path)
+        return types.SimpleNamespace(path_display=path), types.SimpleNamespace(content=content)
+
+    def files_list_folder(self, path, recursive=False):
+        time.sleep(self.latency)
+        local_path = self._path(path)
+        if not os.path.isdir(local_path):
+            raise self._not_found(path)
+        entries = []
+        for directory, folders, names in os.walk(local_path):
+            relative = os.path.relpath(directory, local_path)
+            prefix = path if relative == "." else f"{path}/{relative}"
+            entries.extend(types.SimpleNamespace(name=name, path_display=f"{prefix}/{name}") for name in sorted(folders + names))
+            if not recursive:
+                break
+        return types.SimpleNamespace(entries=entries, has_more=False, cursor=None)
+
+    def files_delete_v2(self, path):
+        time.sleep(self.latency)
+        local_path = self._path(path)
+        if os.path.isdir(local_path):
+            shutil.rmtree(local_path)
+        elif os.path.exists(local_path):
+            os.remove(local_path)
+        else:
+            raise self._not_found(path)
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id - FIRST_USER_ID}"
+        self.display_name = f"User {user_id - FIRST_USER_ID}"
+
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+
+    async def send_message(self, *args, **kwargs):
+        self.done = True
+
+    async def defer(self, *args, **kwargs):
+        self.done = True
+
+    def is_done(self):
+        return self.done
+
+
+class FakeFollowup:
+    async def send(self, *args, **kwargs):
+        pass
+
+
+def fake_interaction(user_id):
+    """Just enough of a discord.Interaction for the command callbacks."""
+    return types.SimpleNamespace(
+        user=FakeUser(user_id), response=FakeResponse(), followup=FakeFollowup(), guild=None, guild_id=None
+    )
+
+
+def seed_logs(directory, num_users, history):
+    """Write `history` log rows for each user, spread over the last few weeks, as /log would have."""
+    random.seed(0)
+    start = datetime.now() - timedelta(days=28)
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + num_users):
+        with open(os.path.join(directory, f"{user_id}_logs.csv"), "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Date", "Sheet Number", "Module", "Progress", "Comment"])
+            for i in range(history):
+                date = start + timedelta(minutes=i * 28 * 24 * 60 // max(history, 1))
+                writer.writerow([
+                    date.strftime("%Y-%m-%d %H:%M:%S"), random.randint(1, 10), random.choice(MODULES),
+                    float(random.randint(1, 20)), "",
+                ])
+
+
+def command_args(name, user_id):
+    """Random arguments for one call of command `name`, like a user would pick."""
+    if name == "log":
+        return (fake_interaction(user_id), random.randint(1, 10), random.choice(MODULES), float(random.randint(1, 30)))
+    if name == "logmany":
+        pairs = ", ".join(f"{module}:{random.randint(1, 30)}" for module in random.sample(MODULES, 3))
+        return (fake_interaction(user_id), random.randint(1, 10), pairs)
+    if name == "leaderboard":
+        sheet = random.choice([None, random.randint(1, 10)])
+        module = random.choice([None, None, random.choice(MODULES)])
+        return (fake_interaction(user_id), sheet, module)
+    if name == "export":
+        return (fake_interaction(user_id), random.choice(["", "1,2,3"]), "")
+    if name == "race":
+        return (fake_interaction(user_id), random.choice(["", str(random.randint(1, 10))]), None, None)
+    return (fake_interaction(user_id),)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def drive(bot, args, mix):
+    """Fire the commands and return ({command: [latency]}, elapsed seconds)."""
+    callbacks = {name: bot.tree.get_command(name).callback for name in mix}
+    names, weights = zip(*mix.items())
+    user_ids = range(FIRST_USER_ID, FIRST_USER_ID + args.users)
+    latencies = {name: [] for name in mix}
+
+    # One call of each first, so worker start-up and imports don't count as latency
+    for name in names:
+        await callbacks[name](*command_args(name, user_ids[0]))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def call(name):
+        async with semaphore:
+            started = time.perf_counter()
+            await callbacks[name](*command_args(name, random.choice(user_ids)))
+            latencies[name].append(time.perf_counter() - started)
+
+    plan = random.choices(names, weights, k=args.commands)
+    started = time.perf_counter()
+    await asyncio.gather(*(call(name) for name in plan))
+    return latencies, time.perf_counter() - started
+
+
+def run_bot(args, mix):
+    """Run start.py with Discord and Dropbox faked out. Returns the drive() results and the shutdown time."""
+    results = {}
+
+    def fake_refresh(self):
+        self.access_token = "local"
+        self.expires_at = time.monotonic() + 4 * 60 * 60
+
+    async def fake_fetch_user(self, user_id):
+        return FakeUser(user_id)
+
+    def fake_run(bot, token, **kwargs):
+        async def main():
+            await bot._async_setup_hook()
+            await bot.setup_hook()
+            await inspect.unwrap(bot.tree.get_command("log").callback).__globals__["data_ready"].wait()
+            results["latencies"], results["elapsed"] = await drive(bot, args, mix)
+            started = time.perf_counter()
+            await bot.close()
+            results["shutdown"] = time.perf_counter() - started
+
+        asyncio.run(main())
+
+    get_new_dropbox_access_token.TokenManager._refresh = fake_refresh
+    dropbox.Dropbox = LocalDropbox
+    commands.Bot.fetch_user = fake_fetch_user
+    commands.Bot.run = fake_run
+    runpy.run_path(os.path.join(REPO, "start.py"), run_name="__main__")
+    return results
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=50, help="log rows per user before the run")
+    parser.add_argument("--commands", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Dropbox call")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("log=5,logmany=1,leaderboard=2,export=1,race=1,alllogs=1,stats=1"))
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's INFO logs")
+    args = parser.parse_args()
+    random.seed(1)
+
+    workdir = tempfile.mkdtemp(prefix="bot-loadtest-")
+    cwd = os.getcwd()
+    try:
+        seed_logs(workdir, args.users, args.history)
+        LocalDropbox.root = os.path.join(workdir, "dropbox")
+        LocalDropbox.latency = args.latency
+        os.chdir(workdir)
+        # The bot's log files and database live in the scratch directory
+        os.environ["PROGRESS_DB"] = os.path.join(workdir, "progress.db")
+        if not args.verbose:
+            os.environ["LOG_LEVEL"] = "WARNING"
+        results = run_bot(args, args.mix)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies, elapsed = results["latencies"], results["elapsed"]
+    total = sum(len(values) for values in latencies.values())
+    report = {
+        "users": args.users, "history": args.history, "concurrency": args.concurrency, "latency": args.latency,
+        "commands_per_second": total / elapsed, "shutdown_seconds": results["shutdown"], "commands": {},
+    }
+    print(f"{args.users} users x {args.history} log rows, {total} commands, concurrency {args.concurrency}, "
+          f"Dropbox latency {args.latency * 1000:.0f} ms")
+    print(f"{'command':<13}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, values in latencies.items():
+        values.sort()
+        stats = {
+            "count": len(values), "p50": percentile(values, 0.5), "p99": percentile(values, 0.99),
+            "max": values[-1] if values else 0.0,
+        }
+        report["commands"][name] = stats
+        print(f"/{name:<12}{stats['count']:>7}{stats['p50'] * 1000:>10.1f}"
+              f"{stats['p99'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}")
+    print(f"{total / elapsed:.1f} commands/sec over {elapsed:.2f} s; shutdown flush {results['shutdown']:.2f} s")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
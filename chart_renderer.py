@@ -0,0 +1,87 @@
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from metrics import metrics
+
+
+def render_race_png(series):
+    """Render the progress race chart; `series` is a list of (label, dates, cumulative_progress)."""
+    # Imported here so only the worker processes pay for matplotlib
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    for label, dates, cumulative_progress in series:
+        ax.plot(dates, cumulative_progress, label=label)
+
+    ax.set_title("Progress Race")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Cumulative Progress (%)")
+
+    # Ticks adapt to the range shown (hours for a day, months for a semester), so their number stays small
+    locator = mdates.AutoDateLocator(minticks=3, maxticks=10)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+
+    fig.tight_layout()
+
+    ax.legend(title="Users")
+    ax.grid()
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def _warm_up():
+    import matplotlib.figure  # noqa: F401
+
+
+class ChartRenderer:
+    """Renders charts in worker processes and caches the results.
+
+    Results are cached by (key, data version): a repeated request is served from
+    the cache until new progress bumps the version.
+    """
+
+    def __init__(self, workers=2, cache_size=32):
+        # start.py runs the bot at import time, so workers must be forked rather than spawned
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+        self.num_workers = workers
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    async def start(self):
+        """Fork the workers now, before other threads exist, and preload matplotlib in them."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _warm_up) for _ in range(self.num_workers)))
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def render(self, key, version, func, *args, in_process=True):
+        """Return func(*args), cached under (key, version).
+
+        Cheap renders can pass in_process=False to skip the round trip to a worker.
+        """
+        cache_key = (key, version)
+        if cache_key in self.cache:
+            self.cache.move_to_end(cache_key)
+            metrics.inc("chart_cache_hits_total")
+            return self.cache[cache_key]
+
+        metrics.inc("chart_cache_misses_total")
+        with metrics.timer("render_seconds", chart=key[0]):
+            if in_process:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor, func, *args)
+            else:
+                result = func(*args)
+        self.cache[cache_key] = result
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
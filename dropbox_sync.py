@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from snapshots import Snapshots
+
+logger = logging.getLogger(__name__)
+
+
+class DropboxSync:
+    """Background Dropbox sync: command handlers queue uploads, workers run them on a thread pool.
+
+    A single Dropbox client is shared by every job and rebuilt whenever the token
+    manager hands out a new access token. If Dropbox rejects the token anyway, it
+    is refreshed once before retrying. The Dropbox SDK is only imported on the
+    worker threads, when it is first needed.
+    """
+
+    def __init__(self, tokens, max_queue=100, workers=2, compact_every=20):
+        self.tokens = tokens
+        self.dbx = None
+        self.dbx_token = None
+        self.refresher = None
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dropbox-sync")
+        self.num_workers = workers
+        self.workers = []
+        # Append-only uploads: bytes of each file already on Dropbox and segments since the last full upload
+        self.compact_every = compact_every
+        self.delta_files = {}
+        self.delta_offsets = {}
+        self.delta_segments = {}
+        self.delta_locks = {}
+        self.delta_locks_lock = threading.Lock()
+        self.snapshots = Snapshots(self._call)
+
+    def start(self):
+        """Start the worker tasks. Must be called from inside the running event loop."""
+        for _ in range(self.num_workers):
+            self.workers.append(asyncio.create_task(self._worker()))
+
+    async def close(self):
+        """Wait for queued uploads to finish, then stop the workers."""
+        await self.queue.join()
+        if self.refresher is not None:
+            self.refresher.cancel()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+        self.executor.shutdown(wait=True)
+
+    async def connect(self):
+        """Fetch the first access token, then keep it refreshed in the background."""
+        loop = asyncio.get_running_loop()
+        db_token = await loop.run_in_executor(self.executor, self.tokens.get_token)
+        if db_token is None:
+            logger.error("Couldn't get Dropbox access token")
+        else:
+            logger.info("Dropbox token is set")
+        self.refresher = asyncio.create_task(self.tokens.keep_fresh())
+
+    async def upload(self, file_path, dropbox_path, backup=True):
+        """Queue a local file for upload. Returns once the job is queued, not uploaded."""
+        await self.queue.put((self._upload, dropbox_path, (file_path, dropbox_path, backup)))
+
+    async def upload_delta(self, file_path, dropbox_path, compact=False):
+        """Queue an append-only upload of whatever was appended to file_path since the last one.
+
+        New bytes go to a small segment file in the `{dropbox_path}.segments/` folder,
+        named after the byte offset it starts at. Every `compact_every` segments (or
+        when `compact` is set) the whole file is uploaded to dropbox_path instead and
+        the segments are deleted. To rebuild the file, take dropbox_path and append
+        the segments in name order, skipping any that start before its size.
+        """
+        self.delta_files[dropbox_path] = file_path
+        await self.queue.put((self._upload_delta, dropbox_path, (file_path, dropbox_path, compact)))
+
+    async def compact_all(self, skip=()):
+        """Queue a full upload of every append-only file that has segments outstanding."""
+        for dropbox_path, segments in list(self.delta_segments.items()):
+            if segments and dropbox_path not in skip:
+                await self.upload_delta(self.delta_files[dropbox_path], dropbox_path, compact=True)
+
+    async def download(self, dropbox_path, local_path):
+        """Download a file from Dropbox on the thread pool. Returns True on success."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._download, dropbox_path, local_path)
+
+    async def restore_snapshot(self, name, local_path, validate=None):
+        """Restore local_path from the newest valid snapshot of `name`. Returns True on success."""
+        loop = asyncio.get_running_loop()
+        try:
+            path = await loop.run_in_executor(self.executor, self.snapshots.restore, name, local_path, validate)
+        except Exception as e:
+            logger.warning("Restoring snapshot failed name=%s error=%s", name, e)
+            return False
+        return path is not None
+
+    async def prune_snapshots(self):
+        """Apply the retention policy to every snapshotted file in Dropbox, not only those this process wrote."""
+        loop = asyncio.get_running_loop()
+        try:
+            all_snapshots = await loop.run_in_executor(self.executor, self.snapshots.list_all)
+        except Exception as e:
+            logger.warning("Listing snapshots failed error=%s", e)
+            return
+        for name, snapshots in all_snapshots.items():
+            try:
+                await loop.run_in_executor(self.executor, self.snapshots.prune, name, snapshots)
+            except Exception as e:
+                logger.warning("Pruning snapshots failed name=%s error=%s", name, e)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, dropbox_path, args = await self.queue.get()
+            try:
+                with metrics.timer("dropbox_job_seconds", job=job.__name__.lstrip("_")):
+                    await loop.run_in_executor(self.executor, job, *args)
+            except Exception as e:
+                logger.error("Dropbox sync failed path=%s error=%s", dropbox_path, e)
+            finally:
+                self.queue.task_done()
+
+    def _client(self, db_token):
+        import dropbox
+        # Rebuild only when the token changed, so the client's connection pool is reused
+        if self.dbx is None or self.dbx_token != db_token:
+            self.dbx = dropbox.Dropbox(db_token)
+            self.dbx_token = db_token
+        return self.dbx
+
+    def _call(self, method, *args, **kwargs):
+        """Call a Dropbox client method by name, refreshing the token once on auth failure."""
+        import dropbox
+        with metrics.timer("dropbox_call_seconds", method=method):
+            dbx = self._client(self.tokens.get_token())
+            try:
+                return getattr(dbx, method)(*args, **kwargs)
+            except dropbox.exceptions.AuthError:
+                metrics.inc("dropbox_token_rejections_total")
+                dbx = self._client(self.tokens.refresh())
+                return getattr(dbx, method)(*args, **kwargs)
+
+    def _download(self, dropbox_path, local_path):
+        try:
+            metadata, response = self._call("files_download", dropbox_path)
+        except Exception as e:
+            # Also covers having no usable token: the caller carries on without the file
+            logger.warning("Dropbox download failed path=%s error=%s", dropbox_path, e)
+            return False
+        with open(local_path, "wb") as file:
+            file.write(response.content)
+        logger.info("Downloaded path=%s to=%s", dropbox_path, local_path)
+        return True
+
+    def _upload(self, file_path, dropbox_path, backup):
+        """Save a file to Dropbox and optionally snapshot it (skipped if unchanged since the last snapshot)."""
+        import dropbox
+        with open(file_path, 'rb') as file:
+            content = file.read()
+
+        overwrite = dropbox.files.WriteMode("overwrite")
+        try:
+            self._call("files_upload", content, dropbox_path, mode=overwrite)
+            logger.info("Uploaded path=%s bytes=%d", dropbox_path, len(content))
+        except dropbox.exceptions.ApiError as e:
+            logger.error("Dropbox upload failed path=%s error=%s", dropbox_path, e)
+
+        if not backup:
+            return
+        try:
+            self.snapshots.save(content, dropbox_path.lstrip("/"))
+        except dropbox.exceptions.ApiError as e:
+            logger.error("Dropbox snapshot failed path=%s error=%s", dropbox_path, e)
+
+    def _upload_delta(self, file_path, dropbox_path, compact):
+        import dropbox
+        with self.delta_locks_lock:
+            lock = self.delta_locks.setdefault(dropbox_path, threading.Lock())
+        with lock, open(file_path, 'rb') as file:
+            content = file.read()
+            offset = self.delta_offsets.get(dropbox_path)
+            segments = self.delta_segments.get(dropbox_path, 0)
+            segments_folder = f"{dropbox_path}.segments"
+
+            # Nothing uploaded yet by this process, or the file was rewritten: start from a full copy
+            if offset is None or offset > len(content) or segments >= self.compact_every:
+                compact = True
+            if compact:
+                self._call("files_upload", content, dropbox_path, mode=dropbox.files.WriteMode("overwrite"))
+                try:
+                    self._call("files_delete_v2", segments_folder)
+                except dropbox.exceptions.ApiError:
+                    pass  # no segments to clean up
+                logger.info("Uploaded path=%s bytes=%d", dropbox_path, len(content))
+                self.delta_offsets[dropbox_path] = len(content)
+                self.delta_segments[dropbox_path] = 0
+                self.snapshots.save(content, dropbox_path.lstrip("/"))
+                return
+
+            if offset == len(content):
+                return
+            segment_path = f"{segments_folder}/{offset:012d}.csv"
+            self._call("files_upload", content[offset:], segment_path, mode=dropbox.files.WriteMode("overwrite"))
+            logger.info("Appended path=%s bytes=%d segment=%s", dropbox_path, len(content) - offset, segment_path)
+            self.delta_offsets[dropbox_path] = len(content)
+            self.delta_segments[dropbox_path] = segments + 1
+
+
+class UploadScheduler:
+    """Coalesces repeated uploads of the same file into at most one upload per window.
+
+    Callers mark a file dirty after writing it; the first mark is uploaded right away
+    and any further marks inside the window are folded into a single upload when
+    the window ends. Call flush_all() on shutdown to push everything still pending.
+    """
+
+    def __init__(self, sync, window=30):
+        self.sync = sync
+        self.window = window
+        self.dirty = {}  # dropbox_path -> (file_path, backup, delta)
+        self.last_flush = {}  # dropbox_path -> loop time of the last upload
+        self.timers = {}  # dropbox_path -> pending flush task
+
+    def mark_dirty(self, file_path, dropbox_path, backup=True, delta=False):
+        """Record that a local file changed and schedule its upload.
+
+        Append-only files can pass delta=True to upload only the new bytes (see
+        DropboxSync.upload_delta); they are snapshotted whenever they are compacted.
+        """
+        self.dirty[dropbox_path] = (file_path, backup, delta)
+        if dropbox_path not in self.timers:
+            self._schedule(dropbox_path)
+
+    async def flush_all(self):
+        """Cancel pending timers and queue every dirty file immediately, compacting append-only ones."""
+        timers = list(self.timers.values())
+        for timer in timers:
+            timer.cancel()
+        await asyncio.gather(*timers, return_exceptions=True)
+        self.timers.clear()
+        flushed = list(self.dirty)
+        for dropbox_path in flushed:
+            await self._flush(dropbox_path, compact=True)
+        await self.sync.compact_all(skip=flushed)
+
+    def _schedule(self, dropbox_path):
+        loop = asyncio.get_running_loop()
+        last = self.last_flush.get(dropbox_path)
+        delay = 0 if last is None else max(0, last + self.window - loop.time())
+        self.timers[dropbox_path] = asyncio.create_task(self._flush_later(dropbox_path, delay))
+
+    async def _flush_later(self, dropbox_path, delay):
+        await asyncio.sleep(delay)
+        await self._flush(dropbox_path)
+        del self.timers[dropbox_path]
+        # Marked again while the upload was being queued
+        if dropbox_path in self.dirty:
+            self._schedule(dropbox_path)
+
+    async def _flush(self, dropbox_path, compact=False):
+        file_path, backup, delta = self.dirty[dropbox_path]
+        if delta:
+            await self.sync.upload_delta(file_path, dropbox_path, compact)
+        else:
+            await self.sync.upload(file_path, dropbox_path, backup)
+        # The worker reads the file after this point, so it sees every write made so far
+        self.dirty.pop(dropbox_path, None)
+        self.last_flush[dropbox_path] = asyncio.get_running_loop().time()
@@ -0,0 +1,85 @@
+"""Gateway settings: which events the bot subscribes to, what discord.py caches, and sharding.
+
+The full mode keeps the original behaviour (every intent, every member and
+the last 1000 messages cached). The lean mode asks only for what slash
+commands need: guild events, so interactions carry their guild, and message
+events only if the ! prefix commands are enabled. No members or messages are
+cached; user names come from user_names.UserNameCache, which fetches on a miss.
+"""
+import discord
+
+DEFAULT_MESSAGE_CACHE = 1000  # discord.py's own default
+
+
+def gateway_options(lean=False, prefix_commands=True, message_cache_size=None):
+    """Keyword arguments for the bot's constructor: intents and cache limits.
+
+    `message_cache_size` of 0 disables the message cache; None uses the mode's default.
+    """
+    if message_cache_size is None:
+        message_cache_size = 0 if lean else DEFAULT_MESSAGE_CACHE
+    if not lean:
+        intents = discord.Intents.all()
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+    else:
+        intents = discord.Intents.none()
+        intents.guilds = True
+        if prefix_commands:
+            intents.guild_messages = True
+            intents.dm_messages = True
+            intents.message_content = True
+        member_cache_flags = discord.MemberCacheFlags.none()
+    return {
+        "intents": intents,
+        "member_cache_flags": member_cache_flags,
+        # Without the members intent there is nothing to chunk; with it, chunking fills the member cache
+        "chunk_guilds_at_startup": not lean,
+        # discord.py treats 0 as "use the default", so None is how the cache is turned off
+        "max_messages": message_cache_size or None,
+    }
+
+
+def parse_shards(shard_count, shard_ids):
+    """Parse SHARD_COUNT ("auto" or a number) and SHARD_IDS (e.g. "0,1") into (count, ids).
+
+    Returns None when sharding is off; a count of None means Discord's recommended count.
+    """
+    if not shard_count:
+        if shard_ids:
+            raise ValueError("SHARD_IDS needs SHARD_COUNT")
+        return None
+    if shard_count == "auto":
+        if shard_ids:
+            raise ValueError("SHARD_IDS needs a numeric SHARD_COUNT")
+        return None, None
+    count = int(shard_count)
+    ids = [int(shard_id) for shard_id in shard_ids.split(",")] if shard_ids else None
+    if ids is not None and any(not 0 <= shard_id < count for shard_id in ids):
+        raise ValueError(f"SHARD_IDS must be between 0 and {count - 1}")
+    return count, ids
+
+
+def shard_for(guild_id, shard_count):
+    """The shard Discord delivers a guild's events on."""
+    return (guild_id >> 22) % shard_count
+
+
+def check_shard_layout(shard_count, shard_ids, guild_partitions, legacy_guild_id=None):
+    """Raise ValueError if this process's shards would share files with another process.
+
+    A process that runs only some of the shards owns the guild partitions of
+    its guilds, which no other process touches. The root partition is shared,
+    so it must belong to a single process: the one that receives DMs (shard 0)
+    and, if set, LEGACY_GUILD_ID's guild.
+    """
+    if shard_count is None or shard_ids is None or set(shard_ids) >= set(range(shard_count)):
+        return  # one process runs every shard
+    if not guild_partitions:
+        raise ValueError("Running a subset of the shards needs GUILD_PARTITIONS=1, so processes don't share files")
+    if legacy_guild_id is not None:
+        legacy_shard = shard_for(legacy_guild_id, shard_count)
+        if (0 in shard_ids) != (legacy_shard in shard_ids):
+            raise ValueError(
+                f"Shards 0 (DMs) and {legacy_shard} (LEGACY_GUILD_ID) both use the root partition, "
+                "so they must run in the same process"
+            )
@@ -1,6 +1,9 @@
-import requests
+import asyncio
 import base64
+import logging
 import os
+import threading
+import time
 
 APP_KEY = os.getenv("DROPBOX_APP_KEY")
 APP_SECRET = os.getenv("DROPBOX_APP_SECRET")
@@ -9,29 +12,82 @@ REFRESH_TOKEN = os.getenv("DROPBOX_REFRESH_TOKEN")
 # Dropbox API endpoint for refreshing tokens
 TOKEN_URL = "https://api.dropboxapi.com/oauth2/token"
 
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """Holds the current Dropbox access token and refreshes it before it expires.
+
+    Refreshes go through one keep-alive HTTP session. get_token() is safe to call
+    from several threads; only one of them performs a refresh.
+    """
+
+    def __init__(self, app_key=APP_KEY, app_secret=APP_SECRET, refresh_token=REFRESH_TOKEN, margin=300):
+        self.app_key = app_key
+        self.app_secret = app_secret
+        self.refresh_token = refresh_token
+        self.margin = margin  # refresh this many seconds before expiry
+        self.access_token = None
+        self.expires_at = 0  # time.monotonic() deadline
+        self.session = None
+        self.lock = threading.Lock()
+
+    def get_token(self):
+        """Return a valid access token, refreshing first if it is missing or about to expire."""
+        with self.lock:
+            if self.access_token is None or time.monotonic() >= self.expires_at - self.margin:
+                self._refresh()
+            return self.access_token
+
+    def refresh(self):
+        """Force a refresh, e.g. after Dropbox rejected the current token."""
+        with self.lock:
+            self._refresh()
+            return self.access_token
+
+    async def keep_fresh(self, retry_delay=60):
+        """Refresh the token in the background shortly before it expires. Runs until cancelled."""
+        while True:
+            delay = self.expires_at - self.margin - time.monotonic()
+            # If the last refresh failed the deadline has already passed; wait before retrying
+            await asyncio.sleep(delay if delay > 0 else retry_delay)
+            await asyncio.to_thread(self.get_token)
+
+    def _refresh(self):
+        import requests
+
+        if self.session is None:
+            self.session = requests.Session()
+
+        # Prepare the HTTP Basic Authentication header
+        credentials = f"{self.app_key}:{self.app_secret}"
+        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+        headers = {
+            "Authorization": f"Basic {encoded_credentials}",
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+
+        # Data for the POST request
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": self.refresh_token,
+        }
+
+        try:
+            response = self.session.post(TOKEN_URL, headers=headers, data=data, timeout=30)
+        except requests.RequestException as e:
+            logger.error("Error refreshing access token: %s", e)
+            return
+
+        # Check the response
+        if response.status_code == 200:
+            new_tokens = response.json()
+            logger.info("Dropbox token refreshed expires_in=%ss", new_tokens["expires_in"])
+            self.access_token = new_tokens["access_token"]
+            self.expires_at = time.monotonic() + new_tokens["expires_in"]
+        else:
+            logger.error("Error refreshing access token: %s", response.text)
+
+
 def refresh_access_token():
-    # Prepare the HTTP Basic Authentication header
-    credentials = f"{APP_KEY}:{APP_SECRET}"
-    encoded_credentials = base64.b64encode(credentials.encode()).decode()
-    headers = {
-        "Authorization": f"Basic {encoded_credentials}",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
-
-    # Data for the POST request
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": REFRESH_TOKEN,
-    }
-
-    # Send the POST request
-    response = requests.post(TOKEN_URL, headers=headers, data=data)
-
-    # Check the response
-    if response.status_code == 200:
-        new_tokens = response.json()
-        print("Token Expires In:", new_tokens["expires_in"], "seconds")
-        return new_tokens["access_token"]
-    else:
-        print("Error refreshing access token:", response.text)
-        return None
+    return TokenManager().refresh()
@@ -0,0 +1,413 @@
+"""Per-guild partitions of the bot's state, loaded on first use and closed when idle.
+
+A partition is everything one cohort needs: its module list, progress store,
+journal, CSV logs, in-memory leaderboard/progress/log-history views and the
+Dropbox prefix its backups live under. The root partition keeps the original
+single-cohort layout (files in the working directory, Dropbox root); guild
+partitions live in guilds/{guild_id}/ and /guilds/{guild_id}/.
+"""
+import asyncio
+import csv
+import itertools
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime
+
+import snapshot_format
+from journal import Journal, atomic_write
+from leaderboard_index import LeaderboardIndex
+from metrics import metrics
+from progress_store import ProgressStore
+from progress_table import ProgressTable
+
+logger = logging.getLogger(__name__)
+
+# Progress backups, newest format first; progress_data.json is only read, for older deployments
+PROGRESS_SNAPSHOT = "progress_data.psb"
+PROGRESS_BACKUPS = (PROGRESS_SNAPSHOT, "progress_data.json")
+JOURNAL_FILE = "progress.journal"
+REJECTED_JOURNAL_FILE = "progress.journal.rejected"  # entries replay could not apply
+# A guild's own module list, set with /setmodules; without one it uses the default list
+MODULES_FILE = "modules.json"
+LOG_HEADER = ["Date", "Sheet Number", "Module", "Progress", "Comment"]
+# Data versions are unique across partitions and reloads, so a reloaded partition never matches stale cached charts
+_data_versions = itertools.count(1)
+
+
+def is_valid_journal_entry(entry):
+    """Whether replay can apply an entry: the fields update_progress_many writes, with progress in 0-100."""
+    try:
+        return (
+            isinstance(entry["seq"], int) and isinstance(entry["user_id"], int)
+            and isinstance(entry["sheet"], str) and isinstance(entry["module"], str)
+            and 0 <= entry["progress"] <= 100 and math.isfinite(entry["delta"])
+            and isinstance(entry["date"], str) and isinstance(entry["comment"], str)
+        )
+    except (KeyError, TypeError):
+        return False
+
+
+def read_module_list(directory):
+    """The module list saved in a partition directory by /setmodules, or None if it has none."""
+    try:
+        with open(os.path.join(directory, MODULES_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def log_row(entry):
+    """The CSV log row for a journal entry: date, sheet number, module, progress delta, comment."""
+    return [entry["date"], entry["sheet"], entry["module"], entry["delta"], entry["comment"]]
+
+
+class Partition:
+    """One cohort's progress, logs and backups. See the module docstring for the layout.
+
+    `sync_ready` is set once Dropbox is connected; a partition with no local
+    progress waits for it to restore its backup.
+    """
+
+    def __init__(self, key, directory, dropbox_prefix, modules, sync, uploads, sync_ready,
+                 db_path="progress.db", journal_fsync=True):
+        self.key = key
+        self.directory = directory
+        self.dropbox_prefix = dropbox_prefix
+        self.modules = list(modules)
+        self.sync = sync
+        self.uploads = uploads
+        self.sync_ready = sync_ready
+        self.db_path = db_path
+        self.journal_fsync = journal_fsync
+        self.store = None
+        self.journal = None
+        self.leaderboard_index = LeaderboardIndex()
+        self.progress_table = ProgressTable()
+        self.race_series = None
+        self.stats = None  # ((data_version, day), log_stats.CohortStats)
+        # Changed on every logged update; cached charts from older versions are stale
+        self.data_version = next(_data_versions)
+        self.pending_journal_seqs = set()
+        self.user_locks = {}  # user_id -> asyncio.Lock held by update_progress_many
+        self.last_used = time.monotonic()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def dropbox_path(self, name):
+        return f"{self.dropbox_prefix}/{name}"
+
+    def get_user_log_file(self, user_id):
+        return self.path(f"{user_id}_logs.csv")
+
+    @property
+    def busy(self):
+        """True while an update is being applied, so the partition must not be closed."""
+        return bool(self.pending_journal_seqs) or any(lock.locked() for lock in self.user_locks.values())
+
+    async def load(self):
+        """Open the partition, restoring its progress from Dropbox if there is none locally,
+        while its log history loads on a worker thread."""
+        # The store's SQLite connection belongs to the event loop's thread
+        self.open()
+        history = asyncio.create_task(asyncio.to_thread(self.load_race_series))
+        if self.store.is_empty():
+            # Fresh container: restore from the Dropbox backup
+            await self.sync_ready.wait()
+            await self.restore_backup()
+            self.read_modules()
+            self.load_progress()
+        self.race_series = await history
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.store = ProgressStore(self.path(self.db_path))
+        self.read_modules()
+        applied = self.store.journal_applied()
+        self.journal = Journal(
+            self.path(JOURNAL_FILE), fsync=self.journal_fsync, start_seq=max(applied.values(), default=0)
+        )
+        self.load_progress()
+        self.replay_journal()
+
+    def close(self):
+        self.journal.close()
+        self.store.close()
+
+    def read_modules(self):
+        self.modules = read_module_list(self.directory) or self.modules
+
+    async def restore_backup(self):
+        """Download the module list and the newest usable progress backup: the binary snapshot,
+        then the legacy JSON, then the newest valid timestamped snapshot of either."""
+        if self.key is not None:
+            # Only guild partitions have their own module list
+            await self.sync.download(self.dropbox_path(MODULES_FILE), self.path(MODULES_FILE))
+        for name in PROGRESS_BACKUPS:
+            if not await self.sync.download(self.dropbox_path(name), self.path(name)):
+                continue
+            if await asyncio.to_thread(self.is_valid_backup, name):
+                return
+            # e.g. a newer snapshot format or a damaged legacy JSON: importing it would fail every load
+            logger.error("Progress backup is unreadable, skipping it partition=%s path=%s", self.key, name)
+            os.remove(self.path(name))
+        for name in PROGRESS_BACKUPS:
+            snapshot_name = self.dropbox_path(name).lstrip("/")
+            if await self.sync.restore_snapshot(snapshot_name, self.path(name), validate=snapshot_format.is_valid):
+                return
+
+    def is_valid_backup(self, name):
+        with open(self.path(name), "rb") as file:
+            return snapshot_format.is_valid(file.read())
+
+    def load_race_series(self):
+        from race_series import RaceSeries
+        series = RaceSeries()
+        series.load_csv_logs(self.directory)
+        return series
+
+    def cohort_stats(self, today):
+        """Stats over the partition's whole log history, recomputed only once progress (or the day) changes."""
+        key = (self.data_version, today)
+        if self.stats is None or self.stats[0] != key:
+            from log_stats import CohortStats, LogColumns
+            with metrics.timer("cohort_stats_seconds"):
+                self.stats = (key, CohortStats(LogColumns(self.race_series), today))
+        return self.stats[1]
+
+    def load_progress(self):
+        """Import the progress backup (or the CSV logs) into the store if it hasn't been done yet."""
+        backups = [self.path(name) for name in PROGRESS_BACKUPS]
+        if not self.store.import_legacy(backups, self.directory) and self.store.is_empty():
+            logger.info("No progress backup found. Starting empty leaderboard. partition=%s", self.key)
+        self.leaderboard_index = LeaderboardIndex()
+        self.leaderboard_index.build(self.store.iter_rows())
+        self.progress_table = ProgressTable(self.modules)
+        self.progress_table.load(self.store.iter_rows())
+
+    def replay_journal(self):
+        """Re-apply journal entries that a crash kept out of the store or the CSV logs.
+
+        Entries that can't be applied are logged and set aside in the rejected
+        journal file rather than stopping the partition from loading.
+        """
+        applied = self.store.journal_applied()
+        last_batches = {}  # user_id -> entries of the user's latest batch
+        rejected = []
+        for entry in self.journal.entries():
+            if not is_valid_journal_entry(entry):
+                logger.error("Skipping invalid journal entry partition=%s entry=%r", self.key, entry)
+                rejected.append(entry)
+                continue
+            batch = last_batches.get(entry["user_id"])
+            if batch and batch[-1].get("batch", batch[-1]["seq"]) == entry.get("batch", entry["seq"]):
+                batch.append(entry)
+            else:
+                last_batches[entry["user_id"]] = [entry]
+            if entry["seq"] > applied.get(entry["user_id"], 0):
+                self.apply_progress([entry])
+                logger.warning("Replayed journal entry seq=%s user=%s", entry["seq"], entry["user_id"])
+        # Only a user's latest batch can be missing from their CSV: /log holds the user's lock until it is written
+        for user_id, entries in last_batches.items():
+            rows = [log_row(entry) for entry in entries]
+            written = self.read_last_log_rows(user_id, len(rows))
+            missing = rows
+            for count in range(len(rows), 0, -1):
+                if written[-count:] == [[str(value) for value in row] for row in rows[:count]]:
+                    missing = rows[count:]
+                    break
+            if missing:
+                self.append_to_user_log(user_id, missing)
+                logger.warning("Restored log rows from the journal user=%s rows=%d", user_id, len(missing))
+        if rejected:
+            # Keep them for inspection: the compaction below drops them from the journal
+            with open(self.path(REJECTED_JOURNAL_FILE), "a") as rejected_file:
+                rejected_file.writelines(json.dumps(entry) + "\n" for entry in rejected)
+                rejected_file.flush()
+                os.fsync(rejected_file.fileno())
+        # Everything is in the store now
+        self.store.checkpoint()
+        self.journal.compact()
+
+    def append_to_user_log(self, user_id, rows):
+        log_file = self.get_user_log_file(user_id)
+        is_new_file = not os.path.exists(log_file)
+
+        with open(log_file, mode='a', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            if is_new_file:
+                writer.writerow(LOG_HEADER)
+            writer.writerows(rows)
+            # Make sure the rows are on disk before the command replies
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+
+    def read_last_log_rows(self, user_id, count):
+        try:
+            with open(self.get_user_log_file(user_id), newline='') as csvfile:
+                rows = list(csv.reader(csvfile))
+        except FileNotFoundError:
+            return []
+        return rows[1:][-count:]
+
+    def save_user_logs(self, user_id, username):
+        """Schedule the user's logs for upload to Dropbox using their username."""
+        log_file = self.get_user_log_file(user_id)
+        if os.path.exists(log_file):
+            # Logs are append-only: upload just the new rows, with a periodic full copy
+            self.uploads.mark_dirty(log_file, self.dropbox_path(f"{username}.csv"), delta=True)
+        else:
+            logger.warning("No logs found for user=%s, skipping Dropbox upload", user_id)
+
+    def save(self):
+        """Export the store to a compact snapshot and schedule its Dropbox backup."""
+        self.store.export_snapshot(self.path(PROGRESS_SNAPSHOT))
+        # Entries already in the store are no longer needed; keep the ones still being applied
+        self.store.checkpoint()
+        self.journal.compact(keep=self.pending_journal_seqs)
+        self.uploads.mark_dirty(self.path(PROGRESS_SNAPSHOT), self.dropbox_path(PROGRESS_SNAPSHOT))
+
+    def set_modules(self, modules):
+        atomic_write(self.path(MODULES_FILE), json.dumps(modules).encode())
+        self.modules = list(modules)
+        self.uploads.mark_dirty(self.path(MODULES_FILE), self.dropbox_path(MODULES_FILE))
+
+    async def update_progress(self, user_id, week, module, progress, comment):
+        await self.update_progress_many(user_id, [(week, module, progress)], comment)
+
+    async def update_progress_many(self, user_id, updates, comment):
+        """Log (sheet, module, progress) updates for one user as a batch: one journal write,
+        one store transaction and one CSV append however many updates there are."""
+        # Nothing reaches the journal that replay couldn't apply
+        for _, _, progress in updates:
+            if not math.isfinite(progress):
+                raise ValueError(f"Progress must be a finite number, got {progress!r}")
+        # One update per user at a time, so two quick /logs can't both start from the same current progress
+        async with self.user_locks.setdefault(user_id, asyncio.Lock()):
+            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            batch_progress = {}  # progress after earlier updates in this batch to the same sheet and module
+            entries = []
+            for week, module, progress in updates:
+                week = str(week)
+                current_progress = batch_progress.get((week, module))
+                if current_progress is None:
+                    current_progress = self.progress_table.get(user_id, week, module)
+                new_progress = min(current_progress + progress, 100)
+                new_progress = max(new_progress, 0)
+                batch_progress[week, module] = new_progress
+                logger.debug(
+                    "Progress update user=%s sheet=%s module=%r logged=%s current=%s new=%s",
+                    user_id, week, module, progress, current_progress, new_progress,
+                )
+                entries.append({
+                    "user_id": user_id, "date": date, "sheet": week, "module": module,
+                    "progress": new_progress, "delta": new_progress - current_progress, "comment": comment,
+                })
+
+            # Journal first, so a crash at any later point can be replayed on startup. The seqs
+            # become pending under the journal's lock, so a save() meanwhile can't compact them away
+            with metrics.timer("journal_append_seconds"):
+                seqs = await asyncio.to_thread(self.journal.append_many, entries, self.pending_journal_seqs)
+            for entry, seq in zip(entries, seqs):
+                entry["seq"] = seq
+            try:
+                self.apply_progress(entries)
+                # Before the next await, so nothing can see the new data version without these rows
+                for entry in entries:
+                    self.race_series.append(user_id, date, entry["sheet"], entry["module"], entry["delta"])
+                await asyncio.to_thread(self.append_to_user_log, user_id, [log_row(entry) for entry in entries])
+            finally:
+                self.pending_journal_seqs.difference_update(seqs)
+
+    def apply_progress(self, entries):
+        """Apply journalled updates for one user to the store, in one transaction, and to the in-memory views."""
+        user_id = entries[0]["user_id"]
+        rows = [(entry["sheet"], entry["module"], entry["progress"]) for entry in entries]
+        self.store.set_progress_many(user_id, rows, journal_seq=entries[-1]["seq"])
+        for week, module, progress in rows:
+            current_progress = self.progress_table.get(user_id, week, module)
+            self.progress_table.set(user_id, week, module, progress)
+            self.leaderboard_index.add(user_id, week, module, progress - current_progress)
+        self.data_version = next(_data_versions)
+        metrics.inc("progress_updates_total", len(entries))
+
+    def get_user_progress(self, user_id):
+        # Every logged sheet lists all modules, with 0 for the ones never logged
+        return self.progress_table.user_progress(user_id, self.modules)
+
+
+class Partitions:
+    """Loads partitions by key on first use and closes the ones unused for `idle_timeout` seconds.
+
+    `factory(key)` builds an unloaded Partition. Concurrent first requests for a
+    key share one load.
+    """
+
+    def __init__(self, factory, idle_timeout=3600):
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.loaded = {}  # key -> Partition
+        self.loading = {}  # key -> task loading it
+
+    def peek(self, key):
+        """The partition for `key` if it is loaded, without loading it or counting as a use."""
+        return self.loaded.get(key)
+
+    async def get(self, key):
+        partition = self.loaded.get(key)
+        if partition is None:
+            # A cancelled command mustn't cancel a load other commands are waiting for
+            partition = await asyncio.shield(self.prefetch(key))
+        partition.last_used = time.monotonic()
+        return partition
+
+    def prefetch(self, key):
+        """Start loading `key` in the background unless it is loaded already. Returns the load task, or None."""
+        if key in self.loaded:
+            return None
+        task = self.loading.get(key)
+        if task is None:
+            task = self.loading[key] = asyncio.create_task(self._load(key))
+        return task
+
+    async def _load(self, key):
+        try:
+            partition = self.factory(key)
+            with metrics.timer("partition_load_seconds"):
+                await partition.load()
+            self.loaded[key] = partition
+            logger.info("Loaded partition=%s", key)
+            return partition
+        finally:
+            del self.loading[key]
+
+    def evict_idle(self):
+        """Save and close partitions idle for longer than idle_timeout. Returns how many were closed.
+
+        The root partition (key None) serves DMs and every unpartitioned server, so it stays loaded.
+        """
+        now = time.monotonic()
+        evicted = 0
+        for key, partition in list(self.loaded.items()):
+            if key is None or partition.busy or now - partition.last_used < self.idle_timeout:
+                continue
+            del self.loaded[key]
+            partition.save()
+            partition.close()
+            evicted += 1
+            logger.info("Evicted idle partition=%s", key)
+        return evicted
+
+    def save_all(self):
+        for partition in self.loaded.values():
+            partition.save()
+
+    def close_all(self):
+        """Save and close every loaded partition, e.g. on shutdown."""
+        for partition in self.loaded.values():
+            partition.save()
+            partition.close()
+        self.loaded.clear()
@@ -0,0 +1,118 @@
+from io import BytesIO
+
+from jinja2 import Environment
+
+# matplotlib's "coolwarm" colormap: red, green and blue at 33 evenly spaced points
+_COOLWARM_RED = [
+    0.2298057, 0.26623388, 0.30386891, 0.342804478, 0.38301334, 0.424369608, 0.46666708,
+    0.509635204, 0.552953156, 0.596262162, 0.639176211, 0.681291281, 0.722193294, 0.761464949,
+    0.798691636, 0.833466556, 0.865395197, 0.897787179, 0.924127593, 0.944468518, 0.958852946,
+    0.96732803, 0.969954137, 0.966811177, 0.958003065, 0.943660866, 0.923944917, 0.89904617,
+    0.869186849, 0.834620542, 0.795631745, 0.752534934, 0.705673158,
+]
+_COOLWARM_GREEN = [
+    0.298717966, 0.353094838, 0.406535296, 0.458757618, 0.50941904, 0.558148092, 0.604562568,
+    0.648280772, 0.688929332, 0.726149107, 0.759599947, 0.788964712, 0.813952739, 0.834302879,
+    0.849786142, 0.860207984, 0.86541021, 0.848937047, 0.827384882, 0.800927443, 0.769767752,
+    0.734132809, 0.694266682, 0.650421156, 0.602842431, 0.551750968, 0.49730856, 0.439559467,
+    0.378313092, 0.312874446, 0.24128379, 0.157246067, 0.01555616,
+]
+_COOLWARM_BLUE = [
+    0.753683153, 0.801466763, 0.84495867, 0.883725899, 0.917387822, 0.945619588, 0.968154911,
+    0.98478814, 0.995375608, 0.999836203, 0.998151185, 0.990363227, 0.976574709, 0.956945269,
+    0.931688648, 0.901068838, 0.865395561, 0.820880546, 0.774508472, 0.726736146, 0.678007945,
+    0.628751763, 0.579375448, 0.530263762, 0.481775914, 0.434243684, 0.387970225, 0.343229596,
+    0.300267182, 0.259301199, 0.220525627, 0.184115123, 0.150232812,
+]
+_LUT_SIZE = 256
+
+
+def _interpolate(anchors, x):
+    position = x * (len(anchors) - 1)
+    i = min(int(position), len(anchors) - 2)
+    return anchors[i] + (position - i) * (anchors[i + 1] - anchors[i])
+
+
+def _relative_luminance(rgb):
+    channels = [c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4 for c in rgb]
+    return 0.2126 * channels[0] + 0.7152 * channels[1] + 0.0722 * channels[2]
+
+
+def _build_lut():
+    """(background, text colour) for each of the 256 steps of coolwarm_r, as pandas' background_gradient picks them."""
+    lut = []
+    for i in range(_LUT_SIZE):
+        x = 1 - i / (_LUT_SIZE - 1)  # reversed colormap
+        rgb = [_interpolate(anchors, x) for anchors in (_COOLWARM_RED, _COOLWARM_GREEN, _COOLWARM_BLUE)]
+        background = "#" + "".join(f"{round(c * 255):02x}" for c in rgb)
+        text_color = "#f1f1f1" if _relative_luminance(rgb) < 0.408 else "#000000"
+        lut.append((background, text_color))
+    return lut
+
+
+COOLWARM_R = _build_lut()
+
+_TEMPLATE = Environment(autoescape=True).from_string(
+    """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <style>
+        table {
+            border-collapse: collapse;
+            width: 100%;
+        }
+        th, td {
+            border: 1px solid black;
+            text-align: center;
+            padding: 8px;
+        }
+    </style>
+</head>
+<body>
+    <h2>Progress Heatmap</h2>
+    <table>
+        <thead>
+            <tr>
+                <th>&nbsp;</th>
+                {%- for module in modules %}
+                <th>{{ module }}</th>
+                {%- endfor %}
+            </tr>
+        </thead>
+        <tbody>
+            {%- for week, row in rows %}
+            <tr>
+                <th>{{ week }}</th>
+                {%- for value, background, text_color in row %}
+                <td style="background-color: {{ background }}; color: {{ text_color }};">{{ value }}</td>
+                {%- endfor %}
+            </tr>
+            {%- endfor %}
+        </tbody>
+    </table>
+</body>
+</html>
+"""
+)
+
+
+def render_heatmap_html(data, weeks, selected_modules):
+    """Render a weeks x modules progress table as an HTML heatmap and return the encoded bytes.
+
+    Values are rounded to whole percentages and coloured with coolwarm_r scaled
+    between the table's minimum and maximum, matching the old pandas Styler output.
+    """
+    values = [[round(value) for value in row] for row in data]
+    flat = [value for row in values for value in row]
+    low = min(flat, default=0)
+    span = max(flat, default=0) - low
+
+    def cell(value):
+        step = int((value - low) / span * _LUT_SIZE) if span else 0
+        return (value, *COOLWARM_R[min(step, _LUT_SIZE - 1)])
+
+    rows = ((week, [cell(value) for value in row]) for week, row in zip(weeks, values))
+    buffer = BytesIO()
+    for chunk in _TEMPLATE.generate(modules=selected_modules, rows=rows):
+        buffer.write(chunk.encode())
+    return buffer.getvalue()
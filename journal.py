@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+
+
+def atomic_write(path, content, fsync=True):
+    """Replace `path` with `content` via a temporary file and rename, so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+        file.flush()
+        if fsync:
+            os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    if fsync:
+        # Make the rename itself durable
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def entry_seq(entry):
+    """The sequence number of a parsed journal line, or None if it isn't an entry with an int seq."""
+    seq = entry.get("seq") if isinstance(entry, dict) else None
+    return seq if isinstance(seq, int) and not isinstance(seq, bool) else None
+
+
+class Journal:
+    """Write-ahead journal of progress updates, one JSON object per line.
+
+    Each /log is appended (and fsynced, if `fsync` is set) before the store or the
+    CSV log changes, so an update interrupted by a crash can be replayed on the
+    next start. Entries get increasing sequence numbers; appends are serialised
+    with a lock so several threads can log at once.
+    """
+
+    def __init__(self, path="progress.journal", fsync=True, start_seq=0):
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        # Malformed entries are left for replay to reject; they don't hold a sequence number
+        self.seq = max([start_seq] + [seq for seq in map(entry_seq, self.entries()) if seq is not None])
+        self.file = open(path, "a")
+
+    def append(self, entry):
+        """Durably record `entry` (a JSON-serialisable dict). Returns its sequence number."""
+        return self.append_many([entry])[0]
+
+    def append_many(self, entries, pending=None):
+        """Durably record several entries with one write and one fsync. Returns their sequence numbers.
+
+        Each entry also gets a "batch" field, the seq of the first entry written with it.
+        The seqs are added to the `pending` set, if given, before the lock is released,
+        so a concurrent compact(keep=pending) can't drop them before they are applied.
+        """
+        with self.lock:
+            batch = self.seq + 1
+            lines = []
+            for entry in entries:
+                self.seq += 1
+                lines.append(json.dumps({**entry, "seq": self.seq, "batch": batch}) + "\n")
+            self.file.write("".join(lines))
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            seqs = list(range(batch, self.seq + 1))
+            if pending is not None:
+                pending.update(seqs)
+            return seqs
+
+    def entries(self):
+        """Return every complete entry in the journal, oldest first.
+
+        A line that is valid JSON but not a well-formed entry is returned as it is, for the caller to reject.
+        """
+        entries = []
+        try:
+            with open(self.path) as file:
+                for line in file:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break  # a write torn by a crash; nothing after it was acknowledged
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def compact(self, keep=()):
+        """Drop every entry except those whose seq is in `keep`, once the rest are safely in the store.
+
+        Entries without a valid seq are always dropped.
+        """
+        with self.lock:
+            lines = "".join(json.dumps(entry) + "\n" for entry in self.entries() if entry_seq(entry) in keep)
+            self.file.close()
+            atomic_write(self.path, lines.encode(), self.fsync)
+            self.file = open(self.path, "a")
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,79 @@
+from bisect import bisect_left, insort
+
+
+class RankedTotals:
+    """Per-user totals plus a list of (-total, user_id) kept sorted for top-k queries."""
+
+    def __init__(self):
+        self.totals = {}
+        self.ranked = []
+
+    def __len__(self):
+        return len(self.totals)
+
+    def __contains__(self, user_id):
+        return user_id in self.totals
+
+    def add(self, user_id, delta):
+        old_total = self.totals.get(user_id)
+        if old_total is not None:
+            del self.ranked[bisect_left(self.ranked, (-old_total, user_id))]
+        new_total = (old_total or 0) + delta
+        self.totals[user_id] = new_total
+        insort(self.ranked, (-new_total, user_id))
+
+    def top(self, k=None, offset=0):
+        entries = self.ranked[offset:] if k is None else self.ranked[offset:offset + k]
+        return [(user_id, -negative_total) for negative_total, user_id in entries]
+
+
+class LeaderboardIndex:
+    """Leaderboard totals per sheet, per module, per sheet+module and overall.
+
+    Updated with each logged delta, so a leaderboard is a slice of an already
+    sorted list instead of a scan over every user's progress.
+    """
+
+    def __init__(self):
+        self.boards = {}  # (sheet or None, module or None) -> RankedTotals
+        self.users = {}  # every user with progress, in first-seen order
+
+    def add(self, user_id, sheet, module, delta):
+        sheet = str(sheet)
+        self.users.setdefault(user_id, None)
+        for key in ((sheet, module), (sheet, None), (None, module), (None, None)):
+            board = self.boards.get(key)
+            if board is None:
+                board = self.boards[key] = RankedTotals()
+            board.add(user_id, delta)
+
+    def build(self, rows):
+        """Load (user_id, sheet, module, progress) rows, e.g. from ProgressStore.iter_rows()."""
+        for user_id, sheet, module, progress in rows:
+            self.add(user_id, sheet, module, progress)
+
+    def __len__(self):
+        """Number of users on every leaderboard (see top())."""
+        return len(self.users)
+
+    def top(self, sheet=None, module=None, k=None, offset=0):
+        """Return [(user_id, total)] best first, starting at rank offset + 1.
+
+        Users with progress elsewhere but none on this sheet/module are listed
+        after the ranked ones with a total of 0.
+        """
+        key = (str(sheet) if sheet is not None else None, module)
+        board = self.boards.get(key, RankedTotals())
+        leaderboard = board.top(k, offset)
+        if k is not None and len(leaderboard) >= k:
+            return leaderboard
+        skip = max(0, offset - len(board))  # zero-total users shown on earlier pages
+        for user_id in self.users:
+            if k is not None and len(leaderboard) >= k:
+                break
+            if user_id not in board:
+                if skip:
+                    skip -= 1
+                    continue
+                leaderboard.append((user_id, 0))
+        return leaderboard
@@ -0,0 +1,59 @@
+import discord
+
+
+class LeaderboardPages(discord.ui.View):
+    """Previous/Next buttons for a leaderboard that is longer than one page.
+
+    Only the names on the page being shown are resolved, so paging through a
+    large server costs one small lookup per click. Pages are read from the live
+    index, so they reflect progress logged after the command was run.
+    """
+
+    def __init__(self, index, user_names, sheet=None, module=None, title="Leaderboard:", page_size=20, timeout=300):
+        super().__init__(timeout=timeout)
+        self.index = index
+        self.user_names = user_names
+        self.sheet = sheet
+        self.module = module
+        self.title = title
+        self.page_size = page_size
+        self.page = 0
+        self.message = None  # set by the caller once the first page is sent
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.index) // self.page_size))
+
+    async def render(self):
+        """Return the current page as a message, updating which buttons are enabled."""
+        offset = self.page * self.page_size
+        leaderboard = self.index.top(sheet=self.sheet, module=self.module, k=self.page_size, offset=offset)
+        names = await self.user_names.resolve([user_id for user_id, _ in leaderboard])
+        lines = [self.title]
+        for rank, (user_id, total) in enumerate(leaderboard, start=offset + 1):
+            lines.append(f"{rank}. {names[user_id][0]} - {total}")
+        if self.page_count > 1:
+            lines.append(f"Page {self.page + 1}/{self.page_count}")
+        self.previous.disabled = self.page == 0
+        self.next.disabled = self.page >= self.page_count - 1
+        return "```" + "\n".join(lines) + "```"
+
+    async def show(self, interaction, page):
+        self.page = max(0, min(page, self.page_count - 1))
+        await interaction.response.edit_message(content=await self.render(), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction, button):
+        await self.show(interaction, self.page - 1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction, button):
+        await self.show(interaction, self.page + 1)
+
+    async def on_timeout(self):
+        # Leave the last page up, without buttons that would no longer respond
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
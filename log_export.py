@@ -0,0 +1,153 @@
+"""Filtered exports of a user's CSV log, streamed in chunks that fit in a Discord attachment.
+
+Rows are read from the CSV one at a time and written straight into an in-memory
+buffer, so exporting a long history never holds more than one chunk. Parquet
+output needs the optional pyarrow package and is only offered when it is installed.
+"""
+import csv
+import gzip
+import io
+from datetime import datetime
+from importlib.util import find_spec
+
+# Checked without importing pyarrow, which stays out of startup until a parquet export needs it
+FORMATS = ("csv", "csv.gz") + (("parquet",) if find_spec("pyarrow") else ())
+HEADER = ["Date", "Sheet Number", "Module", "Progress", "Comment"]
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Room left in each chunk for the gzip trailer and deflate block headers
+GZIP_MARGIN = 1024
+GZIP_FLUSH_EVERY = 1000  # rows between checks of the compressed size
+
+
+class ExportError(ValueError):
+    pass
+
+
+def iter_log_rows(path, sheets=None, module=None, start=None, end=None):
+    """Yield the [date, sheet, module, progress, comment] rows of a log file that match every given filter.
+
+    `sheets` is a collection of sheet numbers as strings; `start` and `end` are
+    datetimes bounding the log date (inclusive).
+    """
+    # Log dates are zero-padded, so comparing the strings compares the dates
+    start = start.strftime(DATE_FORMAT) if start else None
+    end = end.strftime(DATE_FORMAT) if end else None
+    with open(path, newline="") as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)  # header
+        for row in reader:
+            if len(row) < 4:
+                continue
+            date, sheet, row_module = row[0], row[1], row[2]
+            if sheets and sheet not in sheets:
+                continue
+            if module and row_module != module:
+                continue
+            if (start and date < start) or (end and date > end):
+                continue
+            yield row
+
+
+def export_chunks(rows, fmt="csv", limit=25 * 1024 * 1024):
+    """Yield the rows encoded as `fmt`, split into standalone files of at most `limit` bytes each."""
+    if fmt == "csv":
+        return _csv_chunks(rows, limit)
+    if fmt == "csv.gz":
+        return _gzip_chunks(rows, limit)
+    if fmt == "parquet" and fmt in FORMATS:
+        return _parquet_chunks(rows, limit)
+    raise ExportError(f"Unknown export format {fmt!r}. Choose from: {', '.join(FORMATS)}")
+
+
+def _encode_row(row):
+    line = io.StringIO()
+    csv.writer(line).writerow(row)
+    return line.getvalue().encode()
+
+
+def _csv_chunks(rows, limit):
+    header = _encode_row(HEADER)
+    buffer = io.BytesIO()
+    buffer.write(header)
+    has_rows = False
+    for row in rows:
+        line = _encode_row(row)
+        if has_rows and buffer.tell() + len(line) > limit:
+            yield buffer.getvalue()
+            buffer = io.BytesIO()
+            buffer.write(header)
+        buffer.write(line)
+        has_rows = True
+    if has_rows:
+        yield buffer.getvalue()
+
+
+def _gzip_chunks(rows, limit):
+    header = _encode_row(HEADER)
+    buffer = file = None
+    pending = 0  # bytes written since the last flush; they compress to at most about as much
+    since_flush = 0
+    for row in rows:
+        line = _encode_row(row)
+        if file is not None and buffer.tell() + pending + len(line) + GZIP_MARGIN > limit:
+            file.flush()
+            pending = since_flush = 0
+            if buffer.tell() + len(line) + GZIP_MARGIN > limit:
+                file.close()
+                yield buffer.getvalue()
+                file = None
+        if file is None:
+            buffer = io.BytesIO()
+            file = gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0)
+            file.write(header)
+            pending = len(header)
+        file.write(line)
+        pending += len(line)
+        since_flush += 1
+        if since_flush >= GZIP_FLUSH_EVERY:
+            # Compressed bytes already in the buffer are exact; only the unflushed rows need the worst case
+            file.flush()
+            pending = since_flush = 0
+    if file is not None:
+        file.close()
+        yield buffer.getvalue()
+
+
+def _parquet_chunks(rows, limit, batch_rows=100_000):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export needs pyarrow, which isn't installed. Try csv or csv.gz.") from None
+
+    def encode(batch):
+        columns = list(zip(*batch))
+        table = pa.table({
+            "date": pa.array([datetime.strptime(date, DATE_FORMAT) for date in columns[0]], pa.timestamp("s")),
+            "sheet": pa.array(columns[1]),
+            "module": pa.array(columns[2]).dictionary_encode(),
+            "progress": pa.array([float(value) for value in columns[3]]),
+            "comment": pa.array([row[4] if len(row) > 4 else "" for row in batch]),
+        })
+        sink = io.BytesIO()
+        pq.write_table(table, sink, compression="zstd")
+        return sink.getvalue()
+
+    def encode_within_limit(batch):
+        # Parquet sizes aren't known until written: halve oversized batches until they fit
+        data = encode(batch)
+        if len(data) <= limit or len(batch) == 1:
+            yield data
+            return
+        middle = len(batch) // 2
+        yield from encode_within_limit(batch[:middle])
+        yield from encode_within_limit(batch[middle:])
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            yield from encode_within_limit(batch)
+            batch = []
+    if batch:
+        yield from encode_within_limit(batch)
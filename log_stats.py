@@ -0,0 +1,159 @@
+"""Study analytics over a partition's whole log history: pace, streaks, module forecasts and cohort percentiles.
+
+LogColumns lays the in-memory history (race_series.RaceSeries) out as flat NumPy
+columns with one entry per log row. CohortStats computes every user's figures
+from those columns at once with grouped reductions (unique, bincount,
+maximum.at) instead of a Python loop per user, so a cohort with tens of
+thousands of log rows takes milliseconds.
+"""
+from datetime import timedelta
+
+import numpy as np
+
+PACE_DAYS = 14  # pace is the progress logged over this many days, per day
+COHORT_PERCENTILES = (25, 50, 75, 90)
+
+
+class LogColumns:
+    """Every log row as parallel arrays: user index (into user_ids), time, sheet code, module code, progress."""
+
+    def __init__(self, race_series):
+        series = list(race_series.users.items())
+        self.user_ids = np.array([user_id for user_id, _ in series], dtype=np.int64)
+        self.users = np.repeat(np.arange(len(series)), [user.size for _, user in series])
+        self.times = self._concatenate([user.times[:user.size] for _, user in series], "datetime64[s]")
+        self.sheets = self._concatenate([user.sheets[:user.size] for _, user in series], np.int32)
+        self.modules = self._concatenate([user.modules[:user.size] for _, user in series], np.int32)
+        self.progress = self._concatenate([user.progress[:user.size] for _, user in series], np.float64)
+        self.num_sheets = len(race_series.sheet_codes)
+        # Codes are handed out in insertion order, so a module's code is its index here
+        self.module_names = list(race_series.module_codes)
+
+    def __len__(self):
+        return len(self.progress)
+
+    @staticmethod
+    def _concatenate(columns, dtype):
+        return np.concatenate(columns) if columns else np.empty(0, dtype=dtype)
+
+
+class CohortStats:
+    """Per-user pace, streaks and module progress, plus where each user stands in the cohort, as of `today`.
+
+    Module progress is logged progress summed per sheet and clamped to 0-100,
+    as the store keeps it. A module's size is the number of sheets anyone has
+    logged for it, and its forecast finish date is what's left divided by the
+    user's pace on that module.
+    """
+
+    def __init__(self, columns, today, pace_days=PACE_DAYS):
+        self.columns = columns
+        self.today = today
+        self.pace_days = pace_days
+        self.index = {user_id: index for index, user_id in enumerate(columns.user_ids.tolist())}
+        num_users, num_modules = len(columns.user_ids), len(columns.module_names)
+        users, modules, progress = columns.users, columns.modules, columns.progress
+        days = columns.times.astype("datetime64[D]").astype(np.int64)
+        today_day = np.datetime64(today, "D").astype(np.int64)
+
+        # Progress per (user, sheet, module) cell, clamped, then summed per user and per (user, module)
+        sheet_count, module_count = max(columns.num_sheets, 1), max(num_modules, 1)
+        cells, inverse = np.unique(
+            (users.astype(np.int64) * sheet_count + columns.sheets) * module_count + modules, return_inverse=True
+        )
+        cell_progress = np.clip(np.bincount(inverse.ravel(), weights=progress, minlength=len(cells)), 0, 100)
+        cell_users = cells // (sheet_count * module_count)
+        cell_sheets = cells // module_count % sheet_count
+        cell_modules = cells % module_count
+        self.totals = np.bincount(cell_users, weights=cell_progress, minlength=num_users)
+        self.module_progress = np.bincount(
+            cell_users * num_modules + cell_modules, weights=cell_progress, minlength=num_users * num_modules
+        ).reshape(num_users, num_modules)
+        sheet_modules = np.unique(cell_sheets * module_count + cell_modules) % module_count
+        self.module_sheets = np.bincount(sheet_modules, minlength=num_modules)
+
+        # Pace: progress logged over the last pace_days days, per day
+        recent = days > today_day - pace_days
+        self.pace = np.bincount(users[recent], weights=progress[recent], minlength=num_users) / pace_days
+        self.module_pace = np.bincount(
+            users[recent] * num_modules + modules[recent], weights=progress[recent], minlength=num_users * num_modules
+        ).reshape(num_users, num_modules) / pace_days
+
+        # Streaks: runs of consecutive days with a log, per user
+        first_day = days.min() if len(days) else 0
+        day_span = (days.max() - first_day + 1) if len(days) else 1
+        active = np.unique(users.astype(np.int64) * day_span + (days - first_day))
+        active_users, active_days = active // day_span, active % day_span + first_day
+        new_run = np.ones(len(active), dtype=bool)
+        new_run[1:] = (active_users[1:] != active_users[:-1]) | (active_days[1:] != active_days[:-1] + 1)
+        run_starts = np.flatnonzero(new_run)
+        run_lengths = np.diff(np.append(run_starts, len(active)))
+        run_users = active_users[run_starts]
+        self.longest_streak = np.zeros(num_users, dtype=np.int64)
+        np.maximum.at(self.longest_streak, run_users, run_lengths)
+        # A user's last run is still going if it reached yesterday or today
+        last_run = np.ones(len(run_starts), dtype=bool)
+        last_run[:-1] = run_users[1:] != run_users[:-1]
+        alive = last_run & (active_days[run_starts + run_lengths - 1] >= today_day - 1)
+        self.current_streak = np.zeros(num_users, dtype=np.int64)
+        self.current_streak[run_users[alive]] = run_lengths[alive]
+
+        # Percentile ranks: the share of the cohort at or below each user
+        self.total_percentiles = self._percentile_ranks(self.totals)
+        self.pace_percentiles = self._percentile_ranks(self.pace)
+        self.cohort_totals = np.percentile(self.totals, COHORT_PERCENTILES) if num_users else None
+        self.cohort_pace = np.percentile(self.pace, COHORT_PERCENTILES) if num_users else None
+
+    @staticmethod
+    def _percentile_ranks(values):
+        return np.searchsorted(np.sort(values), values, side="right") / max(len(values), 1) * 100
+
+    def forecasts(self, user_id):
+        """Return [(module, percent done, sheets, forecast finish date or None)] for the modules a user has started."""
+        index = self.index[user_id]
+        result = []
+        for code, module in enumerate(self.columns.module_names):
+            done = self.module_progress[index, code]
+            if done <= 0:
+                continue
+            size = 100 * self.module_sheets[code]
+            remaining = size - done
+            pace = self.module_pace[index, code]
+            if remaining <= 0:
+                finish = self.today
+            elif pace > 0:
+                finish = self.today + timedelta(days=int(np.ceil(remaining / pace)))
+            else:
+                finish = None
+            result.append((module, done / size * 100, int(self.module_sheets[code]), finish))
+        return result
+
+    def summary(self, user_id, name):
+        """The /stats message for one user, or None if they have no logs."""
+        index = self.index.get(user_id)
+        if index is None:
+            return None
+        lines = [
+            f"Stats for {name}:",
+            f"Total progress: {self.totals[index]:.0f}% ({self.total_percentiles[index]:.0f}th percentile)",
+            f"Pace: {self.pace[index]:.1f}%/day over the last {self.pace_days} days "
+            f"({self.pace_percentiles[index]:.0f}th percentile)",
+            f"Streak: {self.current_streak[index]} days (longest {self.longest_streak[index]})",
+            "Cohort " + ", ".join(f"p{p}" for p in COHORT_PERCENTILES) + ": "
+            f"total {' / '.join(f'{value:.0f}' for value in self.cohort_totals)}%, "
+            f"pace {' / '.join(f'{value:.1f}' for value in self.cohort_pace)}%/day",
+        ]
+        forecasts = self.forecasts(user_id)
+        if forecasts:
+            lines.append("")
+            lines.append("Module forecasts at your current pace:")
+            width = max(len(module) for module, _, _, _ in forecasts)
+            for module, percent, sheets, finish in forecasts:
+                if percent >= 100:
+                    when = "done"
+                elif finish is None:
+                    when = f"no progress in {self.pace_days} days"
+                else:
+                    when = f"done by {finish:%b %d}"
+                lines.append(f"{module:<{width}}  {percent:3.0f}% of {sheets} sheet{'s' if sheets != 1 else ''}, {when}")
+        return "\n".join(lines)
@@ -0,0 +1,179 @@
+"""In-process metrics: counters, gauges and latency histograms.
+
+Everything records into the shared `metrics` registry. It can be read as
+Prometheus text (Metrics.serve() exposes it over HTTP) or as the short summary
+shown by /botstats.
+"""
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (inf if it is past the last bucket)."""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Metrics:
+    """Thread-safe registry; Dropbox workers record into it from their own threads."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # name -> function returning the current value
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, func):
+        """Report func() as `name` whenever metrics are read."""
+        self.gauges[name] = func
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the block into histogram `name`; errors are also counted in `{name}_errors_total`."""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator form of timer() for coroutine functions, e.g. command callbacks."""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, _labels(labels)), 0)
+
+    def hit_ratio(self, name):
+        """Share of `{name}_hits_total` among hits and misses, or None before the first lookup."""
+        hits = self.counter(f"{name}_hits_total")
+        total = hits + self.counter(f"{name}_misses_total")
+        return hits / total if total else None
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for (name, labels), value in counters:
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, func in sorted(self.gauges.items()):
+            lines.append(f"{name} {func()}")
+        lines.append(f"uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """A short plain-text report: per-operation counts and latencies, gauges and cache hit ratios."""
+        uptime = int(time.time() - self.started)
+        lines = [f"Uptime: {uptime // 3600}h {uptime // 60 % 60}m"]
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        current = None
+        for (name, labels), histogram in histograms:
+            if name != current:
+                current = name
+                lines.append(f"{name}:  count  p50<=  p99<=  errors")
+            label = ",".join(str(value) for _, value in labels) or "-"
+            errors = self.counter(f"{name}_errors_total", **dict(labels))
+            lines.append(
+                f"  {label:<24}{histogram.count:>6}{_ms(histogram.quantile(0.5)):>7}"
+                f"{_ms(histogram.quantile(0.99)):>7}{errors:>8}"
+            )
+        for name, func in sorted(self.gauges.items()):
+            lines.append(f"{name}: {func()}")
+        for name in sorted({name[:-len("_hits_total")] for name, _ in self.counters if name.endswith("_hits_total")}):
+            ratio = self.hit_ratio(name)
+            lines.append(f"{name} hit ratio: {'-' if ratio is None else f'{ratio:.0%}'}")
+        return "\n".join(lines)
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Serve render_prometheus() over HTTP on host:port (any path). Returns the asyncio server."""
+        async def handle(reader, writer):
+            try:
+                await reader.readline()  # the request line; headers and path are ignored
+                body = self.render_prometheus().encode()
+                writer.write(
+                    b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                    b"Content-Length: %d\r\n\r\n" % len(body) + body
+                )
+                await writer.drain()
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+def _ms(seconds):
+    return "inf" if seconds == float("inf") else f"{seconds * 1000:.0f}ms"
+
+
+metrics = Metrics()
@@ -0,0 +1,147 @@
+import csv
+import logging
+import os
+import sqlite3
+
+import snapshot_format
+from journal import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressStore:
+    """SQLite (WAL mode) storage for progress: one row per user, sheet and module.
+
+    Each logged update rewrites only its own row, instead of re-serialising every
+    user's progress like progress_data.json did.
+    """
+
+    def __init__(self, path="progress.db"):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS progress (
+                user_id INTEGER NOT NULL,
+                sheet TEXT NOT NULL,
+                module TEXT NOT NULL,
+                progress REAL NOT NULL,
+                PRIMARY KEY (user_id, sheet, module)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS user_names (
+                user_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                display_name TEXT NOT NULL,
+                resolved_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS journal_applied (
+                user_id INTEGER PRIMARY KEY,
+                seq INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM progress LIMIT 1").fetchone() is None
+
+    def set_progress(self, user_id, sheet, module, progress, journal_seq=None):
+        """Write one row; `journal_seq` records, in the same transaction, the journal entry it applies."""
+        self.set_progress_many(user_id, [(sheet, module, progress)], journal_seq)
+
+    def set_progress_many(self, user_id, rows, journal_seq=None):
+        """Write (sheet, module, progress) rows for one user in a single transaction."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO progress (user_id, sheet, module, progress) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id, sheet, module) DO UPDATE SET progress = excluded.progress",
+                [(user_id, str(sheet), module, progress) for sheet, module, progress in rows],
+            )
+            if journal_seq is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO journal_applied (user_id, seq) VALUES (?, ?)", (user_id, journal_seq)
+                )
+
+    def journal_applied(self):
+        """Return {user_id: seq of the last journal entry applied for that user}."""
+        return dict(self.conn.execute("SELECT user_id, seq FROM journal_applied"))
+
+    def checkpoint(self):
+        """Copy the WAL into the database file and sync it, e.g. before discarding the journal."""
+        self.conn.execute("PRAGMA wal_checkpoint(FULL)")
+
+    def iter_rows(self):
+        """Yield every (user_id, sheet, module, progress) row."""
+        return self.conn.execute("SELECT user_id, sheet, module, progress FROM progress")
+
+    def load_user_names(self):
+        """Return cached (user_id, name, display_name, resolved_at) rows, oldest first."""
+        return self.conn.execute(
+            "SELECT user_id, name, display_name, resolved_at FROM user_names ORDER BY resolved_at"
+        ).fetchall()
+
+    def save_user_names(self, entries):
+        """Save (user_id, name, display_name, resolved_at) rows."""
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO user_names VALUES (?, ?, ?, ?)", entries)
+
+    def export_snapshot(self, path):
+        """Atomically write all progress to `path` in the compact snapshot format (see snapshot_format)."""
+        atomic_write(path, snapshot_format.dumps(self.iter_rows()))
+
+    def import_legacy(self, snapshot_paths=("progress_data.psb", "progress_data.json"), log_dir="."):
+        """One-time import from the first snapshot file that exists (binary or the old JSON),
+        falling back to replaying the per-user CSV logs.
+
+        Does nothing if an import has already run or the store already holds progress.
+        Returns True if anything was imported.
+        """
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_import'").fetchone():
+            return False
+        if not self.is_empty():
+            return False
+
+        rows = None
+        for source in snapshot_paths:
+            if os.path.exists(source):
+                with open(source, "rb") as file:
+                    rows = snapshot_format.read_rows(file.read())
+                break
+        if rows is None:
+            rows = self._rows_from_csv_logs(log_dir)
+            source = "CSV logs"
+        if not rows:
+            return False
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO progress (user_id, sheet, module, progress) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_import', ?)", (source,))
+        logger.info("Imported %d progress rows from %s", len(rows), source)
+        return True
+
+    @staticmethod
+    def _rows_from_csv_logs(log_dir):
+        totals = {}
+        for file in os.listdir(log_dir):
+            if not file.endswith("_logs.csv"):
+                continue
+            user_id = file.partition("_")[0]
+            if not user_id.isdigit():
+                continue
+            with open(os.path.join(log_dir, file), newline="") as csvfile:
+                for row in csv.DictReader(csvfile):
+                    key = (int(user_id), str(row["Sheet Number"]), row["Module"])
+                    # Logged deltas are already clamped, so they sum to the stored value
+                    totals[key] = totals.get(key, 0) + float(row["Progress"])
+        return [(*key, min(max(progress, 0), 100)) for key, progress in totals.items()]
@@ -0,0 +1,109 @@
+from array import array
+
+
+class UserProgress:
+    """One user's progress: the sheet IDs they logged, in row order, and a flat array of
+    len(modules) doubles per row."""
+
+    __slots__ = ("sheet_ids", "values")
+
+    def __init__(self):
+        self.sheet_ids = array("I")  # 32-bit: a partition can see more than 65,536 distinct sheet labels
+        self.values = array("d")
+
+    def row(self, sheet_id):
+        # A user has a handful of sheets, so a scan of the small array beats a dict per user
+        try:
+            return self.sheet_ids.index(sheet_id)
+        except ValueError:
+            return None
+
+
+class ProgressTable:
+    """In-memory progress for every user, stored as dense arrays instead of nested dicts.
+
+    Module names map to column indices and sheet labels to sheet IDs, both shared
+    by all users, and each sheet a user has logged is one row of doubles (exact,
+    unlike float32, since values are re-read and added to). Modules never logged
+    on a sheet read as 0, which matches what update_progress used to materialise
+    explicitly.
+    """
+
+    def __init__(self, modules=()):
+        self.modules = []
+        self.module_index = {}
+        self.sheets = []
+        self.sheet_index = {}
+        self.users = {}
+        for module in modules:
+            self._add_module(module)
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def get(self, user_id, sheet, module):
+        user = self.users.get(user_id)
+        column = self.module_index.get(module)
+        sheet_id = self.sheet_index.get(str(sheet))
+        if user is None or column is None or sheet_id is None:
+            return 0
+        row = user.row(sheet_id)
+        if row is None:
+            return 0
+        return user.values[row * len(self.modules) + column]
+
+    def set(self, user_id, sheet, module, progress):
+        column = self.module_index.get(module)
+        if column is None:
+            column = self._add_module(module)
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = UserProgress()
+        sheet = str(sheet)
+        sheet_id = self.sheet_index.get(sheet)
+        if sheet_id is None:
+            sheet_id = self.sheet_index[sheet] = len(self.sheets)
+            self.sheets.append(sheet)
+        row = user.row(sheet_id)
+        if row is None:
+            row = len(user.sheet_ids)
+            user.sheet_ids.append(sheet_id)
+            user.values.extend([0.0] * len(self.modules))
+        user.values[row * len(self.modules) + column] = progress
+
+    def user_progress(self, user_id, modules=None):
+        """Return {sheet: {module: progress}} for one user, listing every module (or just `modules`)."""
+        user = self.users.get(user_id)
+        if user is None:
+            return {}
+        width = len(self.modules)
+        modules = self.modules if modules is None else modules
+        columns = [(module, self.module_index.get(module)) for module in modules]
+        return {
+            self.sheets[sheet_id]: {
+                module: user.values[row * width + column] if column is not None else 0
+                for module, column in columns
+            }
+            for row, sheet_id in enumerate(user.sheet_ids)
+        }
+
+    def load(self, rows):
+        """Fill the table from (user_id, sheet, module, progress) rows, e.g. ProgressStore.iter_rows()."""
+        for user_id, sheet, module, progress in rows:
+            self.set(user_id, sheet, module, progress)
+
+    def _add_module(self, module):
+        """Add a column; every existing row is widened by one (rare: only for unknown module names)."""
+        old_width = len(self.modules)
+        self.module_index[module] = old_width
+        self.modules.append(module)
+        for user in self.users.values():
+            widened = array("d")
+            for row in range(len(user.sheet_ids)):
+                widened.extend(user.values[row * old_width:(row + 1) * old_width])
+                widened.append(0.0)
+            user.values = widened
+        return old_width
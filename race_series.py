@@ -0,0 +1,207 @@
+import csv
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions, finest first, and their bucket widths in seconds
+ROLLUPS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+# A rollup is used when its buckets over the queried span number at most this many times max_points
+ROLLUP_OVERSAMPLE = 4
+# Buckets are aligned to midnight and weeks start on Monday
+_BUCKET_ORIGIN = np.datetime64("1970-01-05T00:00:00", "s")
+
+
+def bucket_starts(times, resolution):
+    """Floor datetime64 times to the start of their hour, day or week."""
+    width = np.timedelta64(ROLLUPS[resolution], "s")
+    return _BUCKET_ORIGIN + (times - _BUCKET_ORIGIN) // width * width
+
+
+def lttb(x, y, max_points):
+    """Indices of at most `max_points` points of (x, y) chosen by Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept; from each bucket in between, the point
+    forming the largest triangle with the previously chosen point and the
+    average of the next bucket, which preserves peaks and steps of the shape.
+    """
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        low, high = edges[i], edges[i + 1]
+        next_high = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[high:next_high].mean(), y[high:next_high].mean()
+        area = np.abs((x[a] - next_x) * (y[low:high] - y[a]) - (x[a] - x[low:high]) * (next_y - y[a]))
+        a = low + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+class UserSeries:
+    """One user's log history as growable columns (time, sheet code, module code, progress delta)."""
+
+    __slots__ = ("times", "sheets", "modules", "progress", "size", "rollups")
+
+    def __init__(self, capacity=16):
+        self.times = np.empty(capacity, dtype="datetime64[s]")
+        self.sheets = np.empty(capacity, dtype=np.int32)
+        self.modules = np.empty(capacity, dtype=np.int32)
+        self.progress = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.rollups = {}  # resolution -> rollup(resolution), until the next append
+
+    def append(self, time, sheet_code, module_code, progress):
+        if self.size == len(self.times):
+            capacity = 2 * len(self.times)
+            for name in ("times", "sheets", "modules", "progress"):
+                column = getattr(self, name)
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                setattr(self, name, grown)
+        self.times[self.size] = time
+        self.sheets[self.size] = sheet_code
+        self.modules[self.size] = module_code
+        self.progress[self.size] = progress
+        self.size += 1
+        self.rollups.clear()
+
+    def rollup(self, resolution):
+        """Progress summed per bucket, sheet and module, as (bucket starts, sheet codes, module codes, progress)
+        sorted by bucket. Built from the log on first use and kept until the next append."""
+        rollup = self.rollups.get(resolution)
+        if rollup is None:
+            buckets = bucket_starts(self.times[:self.size], resolution)
+            keys = np.column_stack((buckets.astype(np.int64), self.sheets[:self.size], self.modules[:self.size]))
+            keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+            sums = np.bincount(inverse.ravel(), weights=self.progress[:self.size], minlength=len(keys))
+            rollup = self.rollups[resolution] = (
+                keys[:, 0].astype("datetime64[s]"), keys[:, 1].astype(np.int32), keys[:, 2].astype(np.int32), sums
+            )
+        return rollup
+
+
+class RaceSeries:
+    """Every user's log history kept in memory, so /race doesn't re-read the CSV logs.
+
+    Sheets and modules are stored as integer codes; a query filters each user's
+    columns with a boolean mask, sums logs sharing a timestamp and takes the
+    cumulative sum, all in NumPy.
+    """
+
+    def __init__(self):
+        self.users = {}  # user_id -> UserSeries
+        self.sheet_codes = {}
+        self.module_codes = {}
+
+    def append(self, user_id, date, sheet_number, module, progress):
+        """Record one log row; `date` is a "%Y-%m-%d %H:%M:%S" string or datetime."""
+        series = self.users.get(user_id)
+        if series is None:
+            series = self.users[user_id] = UserSeries()
+        sheet_code = self.sheet_codes.setdefault(str(sheet_number), len(self.sheet_codes))
+        module_code = self.module_codes.setdefault(module, len(self.module_codes))
+        series.append(np.datetime64(date, "s"), sheet_code, module_code, float(progress))
+
+    def load_csv_logs(self, log_dir="."):
+        """Load every {user_id}_logs.csv in log_dir."""
+        for file in os.listdir(log_dir):
+            user_id = file.partition("_")[0]
+            if not file.endswith("_logs.csv") or not user_id.isdigit():
+                continue
+            try:
+                with open(os.path.join(log_dir, file), newline="") as csvfile:
+                    for row in csv.DictReader(csvfile):
+                        self.append(int(user_id), row["Date"], row["Sheet Number"], row["Module"], row["Progress"])
+            except (KeyError, ValueError) as e:
+                logger.warning("Error reading log file=%s error=%s", file, e)
+
+    def query(self, sheets=None, module=None, start_date=None, end_time=None, max_points=None):
+        """Return {user_id: (times, cumulative_progress)} for users with matching logs.
+
+        Each series starts at 0 at the first matching log and, if `end_time` is
+        given, ends with a flat point at `end_time`. With `max_points`, a user with
+        more matching logs than that is read from the finest hourly, daily or
+        weekly rollup suited to the span (a bucket's point sits at its end), and
+        a series still longer than `max_points` is downsampled with LTTB.
+        """
+        sheet_codes = None
+        if sheets:
+            sheet_codes = [self.sheet_codes[s] for s in map(str, sheets) if s in self.sheet_codes]
+        if module is not None and module not in self.module_codes:
+            return {}
+        module_code = self.module_codes.get(module)
+        start = np.datetime64(start_date, "s") if start_date is not None else None
+        end = np.datetime64(end_time, "s") if end_time is not None else None
+
+        result = {}
+        for user_id, series in self.users.items():
+            times = series.times[:series.size]
+            mask = self._mask(times, series.sheets[:series.size], series.modules[:series.size],
+                              sheet_codes, module_code, start)
+            count = np.count_nonzero(mask)
+            if not count:
+                continue
+            times = times[mask]
+            first_time, last_time = times.min(), times.max()
+
+            resolution = None
+            if max_points is not None and count > max_points:
+                resolution = self._resolution((end if end is not None else last_time) - first_time, start, max_points)
+            if resolution is None:
+                progress = series.progress[:series.size][mask]
+                order = np.argsort(times, kind="stable")
+                times = times[order]
+                progress = progress[order]
+            else:
+                buckets, bucket_sheets, bucket_modules, progress = series.rollup(resolution)
+                bucket_mask = self._mask(buckets, bucket_sheets, bucket_modules, sheet_codes, module_code, start)
+                # Progress logged during a bucket is all in by its end, or by the last log
+                width = np.timedelta64(ROLLUPS[resolution], "s")
+                times = np.minimum(buckets[bucket_mask] + width, last_time)
+                progress = progress[bucket_mask]
+            # Sum logs sharing a timestamp, then accumulate
+            unique_times, first_index = np.unique(times, return_index=True)
+            cumulative = np.cumsum(np.add.reduceat(progress, first_index))
+
+            times = np.concatenate(([first_time], unique_times))
+            cumulative = np.concatenate(([0.0], cumulative))
+            if end is not None:
+                times = np.append(times, end)
+                cumulative = np.append(cumulative, cumulative[-1])
+            if max_points is not None and len(times) > max_points:
+                keep = lttb(times.astype(np.int64).astype(np.float64), cumulative, max_points)
+                times, cumulative = times[keep], cumulative[keep]
+            result[user_id] = (times, cumulative)
+        return result
+
+    @staticmethod
+    def _mask(times, sheets, modules, sheet_codes, module_code, start):
+        mask = np.ones(len(times), dtype=bool)
+        if sheet_codes is not None:
+            mask &= np.isin(sheets, sheet_codes)
+        if module_code is not None:
+            mask &= modules == module_code
+        if start is not None:
+            mask &= times >= start
+        return mask
+
+    @staticmethod
+    def _resolution(span, start, max_points):
+        """The finest rollup with at most ROLLUP_OVERSAMPLE * max_points buckets over `span`.
+
+        Only rollups whose buckets line up with `start` qualify, so filtering buckets
+        by start date is exact; None (the raw logs) if none do.
+        """
+        seconds = span / np.timedelta64(1, "s")
+        aligned = [resolution for resolution in ROLLUPS if start is None or bucket_starts(start, resolution) == start]
+        for resolution in aligned:
+            if seconds / ROLLUPS[resolution] <= ROLLUP_OVERSAMPLE * max_points:
+                return resolution
+        return aligned[-1] if aligned else None
@@ -0,0 +1,130 @@
+"""Compact binary snapshot of progress rows, used for backups instead of progress_data.json.
+
+Layout (little-endian):
+
+    header   b"PSB" magic, u8 format version, u32 CRC-32 of the body, u32 body length
+    body     zlib-compressed payload
+
+and the payload is
+
+    u32 module count, then each module name as u32 length + UTF-8
+    u32 sheet count, then each sheet label as u32 length + UTF-8
+    u32 row count, then the rows column by column:
+        i64 user IDs, u32 sheet indices, u32 module indices, f64 progress
+
+Module and sheet names are stored once and referenced by index, so the long
+module names aren't repeated for every user and sheet. Version 1 used u16 for
+the counts, lengths and indices, which capped a snapshot at 65,536 sheet labels;
+loads() still reads it. read_rows() also accepts the old progress_data.json layout.
+"""
+import json
+import struct
+import zlib
+
+MAGIC = b"PSB"
+VERSION = 2
+_HEADER = struct.Struct("<3sBII")
+_INDEX_CODES = {1: "H", 2: "I"}  # format version -> struct code of counts, lengths and indices
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _pack_strings(strings):
+    parts = [struct.pack("<I", len(strings))]
+    for string in strings:
+        encoded = string.encode()
+        parts.append(struct.pack("<I", len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
+
+
+def _unpack_strings(payload, offset, code="I"):
+    size = struct.calcsize(code)
+    (count,) = struct.unpack_from(f"<{code}", payload, offset)
+    offset += size
+    strings = []
+    for _ in range(count):
+        (length,) = struct.unpack_from(f"<{code}", payload, offset)
+        offset += size
+        strings.append(payload[offset:offset + length].decode())
+        offset += length
+    return strings, offset
+
+
+def dumps(rows):
+    """Serialise (user_id, sheet, module, progress) rows into snapshot bytes."""
+    rows = list(rows)
+    modules = {}
+    sheets = {}
+    for _, sheet, module, _ in rows:
+        sheets.setdefault(str(sheet), len(sheets))
+        modules.setdefault(module, len(modules))
+
+    n = len(rows)
+    payload = b"".join((
+        _pack_strings(list(modules)),
+        _pack_strings(list(sheets)),
+        struct.pack("<I", n),
+        struct.pack(f"<{n}q", *(row[0] for row in rows)),
+        struct.pack(f"<{n}I", *(sheets[str(row[1])] for row in rows)),
+        struct.pack(f"<{n}I", *(modules[row[2]] for row in rows)),
+        struct.pack(f"<{n}d", *(row[3] for row in rows)),
+    ))
+    body = zlib.compress(payload, 9)
+    return _HEADER.pack(MAGIC, VERSION, zlib.crc32(body), len(body)) + body
+
+
+def loads(data):
+    """Parse snapshot bytes back into a list of (user_id, sheet, module, progress) rows."""
+    if len(data) < _HEADER.size:
+        raise SnapshotError("Snapshot is truncated")
+    magic, version, checksum, length = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError("Not a progress snapshot")
+    code = _INDEX_CODES.get(version)
+    if code is None:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+    size = struct.calcsize(code)
+    body = data[_HEADER.size:]
+    if len(body) != length or zlib.crc32(body) != checksum:
+        raise SnapshotError("Snapshot checksum mismatch")
+
+    payload = zlib.decompress(body)
+    modules, offset = _unpack_strings(payload, 0, code)
+    sheets, offset = _unpack_strings(payload, offset, code)
+    (n,) = struct.unpack_from("<I", payload, offset)
+    offset += 4
+    user_ids = struct.unpack_from(f"<{n}q", payload, offset)
+    offset += 8 * n
+    sheet_indices = struct.unpack_from(f"<{n}{code}", payload, offset)
+    offset += size * n
+    module_indices = struct.unpack_from(f"<{n}{code}", payload, offset)
+    offset += size * n
+    progress = struct.unpack_from(f"<{n}d", payload, offset)
+    return [
+        (user_id, sheets[sheet], modules[module], value)
+        for user_id, sheet, module, value in zip(user_ids, sheet_indices, module_indices, progress)
+    ]
+
+
+def read_rows(data):
+    """Parse either a binary snapshot or the legacy progress_data.json contents."""
+    if data[:len(MAGIC)] == MAGIC:
+        return loads(data)
+    loaded_data = json.loads(data)
+    return [
+        (int(user_id), str(sheet), module, progress)
+        for user_id, sheets in loaded_data.items()
+        for sheet, modules_progress in sheets.items()
+        for module, progress in modules_progress.items()
+    ]
+
+
+def is_valid(data):
+    try:
+        read_rows(data)
+    except (SnapshotError, ValueError, TypeError, AttributeError, struct.error, zlib.error):
+        return False
+    return True
@@ -0,0 +1,203 @@
+"""Timestamped, content-addressed Dropbox snapshots with tiered retention.
+
+Snapshots of `name` live in /snapshots/{name}/ as {YYYYmmddTHHMMSSZ}_{sha256[:16]}_{basename}.
+Run as a script to inspect or restore them:
+
+    python snapshots.py list progress_data.psb
+    python snapshots.py restore progress_data.psb [local_path]
+    python snapshots.py prune progress_data.psb
+    python snapshots.py prune-all
+"""
+import hashlib
+import logging
+import sys
+from datetime import datetime, timezone
+
+SNAPSHOT_ROOT = "/snapshots"
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+HASH_LENGTH = 16
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+
+
+def parse_snapshot_name(filename):
+    """Return (timestamp, hash) for a snapshot filename, or None if it isn't one."""
+    timestamp, _, rest = filename.partition("_")
+    digest, _, _ = rest.partition("_")
+    try:
+        return datetime.strptime(timestamp, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc), digest
+    except ValueError:
+        return None
+
+
+def snapshots_to_keep(timestamps, hourly=24, daily=7, weekly=8):
+    """Pick the timestamps to keep: the newest snapshot in each of the last `hourly` hours,
+    `daily` days and `weekly` ISO weeks that have one, plus the newest overall."""
+    ordered = sorted(timestamps, reverse=True)
+    keep = set(ordered[:1])
+    tiers = (
+        (hourly, lambda ts: (ts.date(), ts.hour)),
+        (daily, lambda ts: ts.date()),
+        (weekly, lambda ts: ts.isocalendar()[:2]),
+    )
+    for count, bucket in tiers:
+        buckets = set()
+        for ts in ordered:
+            key = bucket(ts)
+            if key in buckets:
+                continue
+            if len(buckets) >= count:
+                break
+            buckets.add(key)
+            keep.add(ts)
+    return keep
+
+
+class Snapshots:
+    """Saves, prunes and restores snapshots through `call`, a function like DropboxSync._call.
+
+    All methods block on Dropbox, so run them on a worker thread.
+    """
+
+    def __init__(self, call, hourly=24, daily=7, weekly=8):
+        self.call = call
+        self.retention = {"hourly": hourly, "daily": daily, "weekly": weekly}
+        self.last_hashes = {}  # name -> hash of the newest snapshot
+
+    def folder(self, name):
+        return f"{SNAPSHOT_ROOT}/{name}"
+
+    def save(self, content, name):
+        """Upload a snapshot of `content`, unless it is identical to the newest one. Returns the path or None."""
+        import dropbox
+
+        digest = content_hash(content)
+        if name not in self.last_hashes:
+            newest = self.list(name)
+            self.last_hashes[name] = newest[0][2] if newest else None
+        if self.last_hashes[name] == digest:
+            return None
+
+        timestamp = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+        # `name` may be a path such as guilds/{id}/user.csv; the folder already says which file it is
+        path = f"{self.folder(name)}/{timestamp}_{digest}_{name.rpartition('/')[2]}"
+        self.call("files_upload", content, path, mode=dropbox.files.WriteMode("overwrite"))
+        self.last_hashes[name] = digest
+        logger.info("Snapshot uploaded path=%s", path)
+        return path
+
+    def _list_folder(self, folder, recursive=False):
+        import dropbox
+
+        try:
+            result = self.call("files_list_folder", folder, recursive=recursive)
+        except dropbox.exceptions.ApiError:
+            return []  # no snapshots yet
+        entries = list(result.entries)
+        while result.has_more:
+            result = self.call("files_list_folder_continue", result.cursor)
+            entries.extend(result.entries)
+        return entries
+
+    def list(self, name):
+        """Return [(timestamp, path, hash)] for the snapshots of `name`, newest first."""
+        snapshots = []
+        for entry in self._list_folder(self.folder(name)):
+            parsed = parse_snapshot_name(entry.name)
+            if parsed:
+                snapshots.append((parsed[0], entry.path_display, parsed[1]))
+        snapshots.sort(reverse=True)
+        return snapshots
+
+    def list_all(self):
+        """Return {name: [(timestamp, path, hash)]} for every name under SNAPSHOT_ROOT, from one recursive listing.
+
+        This includes names that no running process snapshots any more, e.g. users
+        who stopped logging, idle guilds or the legacy progress_data.json.
+        """
+        all_snapshots = {}
+        for entry in self._list_folder(SNAPSHOT_ROOT, recursive=True):
+            parsed = parse_snapshot_name(entry.name)
+            folder, _, _ = entry.path_display.rpartition("/")
+            # Folders have no timestamp prefix, so only snapshot files get this far
+            if parsed and folder.lower().startswith(SNAPSHOT_ROOT + "/"):
+                name = folder[len(SNAPSHOT_ROOT) + 1:]
+                all_snapshots.setdefault(name, []).append((parsed[0], entry.path_display, parsed[1]))
+        for snapshots in all_snapshots.values():
+            snapshots.sort(reverse=True)
+        return all_snapshots
+
+    def prune(self, name, snapshots=None):
+        """Delete the snapshots of `name` that fall outside the retention policy. Returns how many.
+
+        `snapshots` is the name's listing if the caller already has it, as list_all() returns it.
+        """
+        if snapshots is None:
+            snapshots = self.list(name)
+        keep = snapshots_to_keep([ts for ts, _, _ in snapshots], **self.retention)
+        deleted = 0
+        for ts, path, _ in snapshots:
+            if ts not in keep:
+                self.call("files_delete_v2", path)
+                deleted += 1
+        if deleted:
+            logger.info("Pruned old snapshots name=%s count=%d", name, deleted)
+        return deleted
+
+    def restore(self, name, local_path, validate=None):
+        """Write the newest snapshot whose content matches its hash (and passes `validate`) to local_path.
+
+        Returns the snapshot path, or None if there is no valid snapshot.
+        """
+        import dropbox
+
+        for _, path, digest in self.list(name):
+            try:
+                _, response = self.call("files_download", path)
+            except dropbox.exceptions.ApiError as e:
+                logger.warning("Couldn't download snapshot path=%s error=%s", path, e)
+                continue
+            content = response.content
+            if content_hash(content) != digest or (validate and not validate(content)):
+                logger.warning("Skipping corrupt snapshot path=%s", path)
+                continue
+            with open(local_path, "wb") as file:
+                file.write(content)
+            logger.info("Restored %s from snapshot path=%s", local_path, path)
+            return path
+        return None
+
+
+def main(argv):
+    from dropbox_sync import DropboxSync
+    from get_new_dropbox_access_token import TokenManager
+
+    if not (argv[:1] == ["prune-all"] or len(argv) >= 2 and argv[0] in ("list", "restore", "prune")):
+        print(__doc__)
+        return 1
+    command, name = argv[0], argv[1] if len(argv) > 1 else None
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sync = DropboxSync(TokenManager())
+    snapshots = sync.snapshots
+    if command == "prune-all":
+        for name, name_snapshots in snapshots.list_all().items():
+            snapshots.prune(name, name_snapshots)
+    elif command == "list":
+        for ts, path, digest in snapshots.list(name):
+            print(f"{ts:%Y-%m-%d %H:%M:%S}  {digest}  {path}")
+    elif command == "restore":
+        local_path = argv[2] if len(argv) > 2 else name
+        if snapshots.restore(name, local_path) is None:
+            print(f"No valid snapshot of {name} found.")
+            return 1
+    else:
+        snapshots.prune(name)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
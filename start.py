@@ -1,139 +1,193 @@
+from startup_timing import StartupTimer
+startup_timer = StartupTimer()
+
 import discord
 from discord import app_commands
 from discord.ext import commands
-import pandas as pd
-from datetime import datetime
-from jinja2 import Template
-import json
+from datetime import date, datetime, timedelta
 import asyncio
+import math
 import os
-import dropbox
-import random
-import string
-import csv
-import matplotlib.pyplot as plt
+import logging
 from io import BytesIO
-import matplotlib.dates as mdates
-from get_new_dropbox_access_token import refresh_access_token
+from dropbox_sync import DropboxSync, UploadScheduler
+from get_new_dropbox_access_token import TokenManager
+from progress_store import ProgressStore
+from guild_partitions import Partition, Partitions, read_module_list
+from leaderboard_view import LeaderboardPages
+from user_names import UserNameCache
+from chart_renderer import ChartRenderer, render_race_png
+from log_export import FORMATS, ExportError, export_chunks, iter_log_rows
+from metrics import metrics
+from gateway import check_shard_layout, gateway_options, parse_shards
+# NumPy (race_series, log_stats), matplotlib, jinja2, pyarrow and the Dropbox SDK are imported by the code that uses them
+startup_timer.mark("imports")
+
+# LOG_LEVEL=DEBUG also shows every progress update; discord.py logs through the same handler
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
 
 token = os.getenv("TOKEN_DISCORD")
 if token is None:
-    print("DISCORD_TOKEN environment variable not set!")
+    logger.error("TOKEN_DISCORD environment variable not set!")
 else:
-    print("Bot token is set successfully!")
-
-db_token = refresh_access_token()
-if db_token is None:
-    print("Couldn't get Dropbox access token!")
-else:
-    print("Dropbox token is set successfully!")
+    logger.info("Bot token is set")
+
+# The Dropbox token is fetched in the background once the bot starts, then refreshed before it expires
+token_manager = TokenManager()
+dropbox_sync = DropboxSync(token_manager)
+# Each file is uploaded at most once per window (seconds); repeated writes are coalesced
+upload_scheduler = UploadScheduler(dropbox_sync, window=float(os.getenv("DROPBOX_SYNC_WINDOW", "30")))
+
+# LEAN_GATEWAY=1 subscribes only to the events slash commands need and caches no members or messages
+# (see gateway.py); the ! prefix commands then stay off unless PREFIX_COMMANDS=1.
+LEAN_GATEWAY = os.getenv("LEAN_GATEWAY") == "1"
+PREFIX_COMMANDS = os.getenv("PREFIX_COMMANDS", "0" if LEAN_GATEWAY else "1") == "1"
+MESSAGE_CACHE_SIZE = int(os.environ["MESSAGE_CACHE_SIZE"]) if os.getenv("MESSAGE_CACHE_SIZE") else None
+# SHARD_COUNT=auto (or a number) runs an AutoShardedBot; SHARD_IDS=0,1 runs just those shards in this process
+SHARDS = parse_shards(os.getenv("SHARD_COUNT"), os.getenv("SHARD_IDS"))
+
+class ProblemSheetBot(commands.AutoShardedBot if SHARDS else commands.Bot):
+    async def setup_hook(self):
+        startup_timer.mark("setup_hook")
+        # Fork the chart workers first: load_data and the upload jobs start threads, which a fork mustn't copy
+        await chart_renderer.start()
+        dropbox_sync.start()
+        # Don't hold up the gateway connection: commands wait for data_ready instead
+        self.loop.create_task(load_data())
+        self.loop.create_task(save_periodically())
+        self.loop.create_task(prune_snapshots_periodically())
+        self.loop.create_task(evict_partitions_periodically())
+        # Optional Prometheus endpoint, e.g. METRICS_PORT=9100, served on localhost only
+        self.metrics_server = None
+        if os.getenv("METRICS_PORT"):
+            self.metrics_server = await metrics.serve(int(os.getenv("METRICS_PORT")))
+
+    async def close(self):
+        # Push everything still pending to Dropbox before disconnecting
+        partitions.close_all()
+        await upload_scheduler.flush_all()
+        await dropbox_sync.close()
+        chart_renderer.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        await super().close()
 
 # Bot setup
-intents = discord.Intents.all()
-intents.messages = True
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-# Helper functions
-def load_progress_data():
-    global progress_data
-    try:
-        with open("progress_data.json", "r") as file:
-            loaded_data = json.load(file)
-            progress_data = {int(user_id): v for user_id, v in loaded_data.items()}
+bot_options = gateway_options(LEAN_GATEWAY, PREFIX_COMMANDS, MESSAGE_CACHE_SIZE)
+if SHARDS:
+    bot_options["shard_count"], bot_options["shard_ids"] = SHARDS
+bot = ProblemSheetBot(command_prefix="!", **bot_options)
+logger.info("Gateway lean=%s prefix_commands=%s shards=%s", LEAN_GATEWAY, PREFIX_COMMANDS, SHARDS)
 
-    except FileNotFoundError:
-        print("progress_data.json not found. Starting empty leaderboard.")
-        progress_data = {}
+# Set once Dropbox is connected and, without guild partitions, the root partition is loaded;
+# commands that read or write progress wait for it
+data_ready = asyncio.Event()
+dropbox_connected = asyncio.Event()
 
-def load_from_dropbox(dropbox_path, local_path, db_token):
-    dbx = dropbox.Dropbox(db_token)
+# Helper functions
+async def load_data():
+    """Connect to Dropbox and, unless every guild has its own partition, load the root partition
+    (which restores from Dropbox once connected if there is no local progress)."""
     try:
-        metadata, response = dbx.files_download(dropbox_path)
-        with open(local_path, "wb") as file:
-            file.write(response.content)
-        print(f"File downloaded successfully to {local_path}")
-    except dropbox.exceptions.ApiError as e:
-        print(f"Dropbox API error while downloading: {e}")
-
-def save_to_dropbox(file_path, dropbox_path, db_token):
-    """Save a file to Dropbox and also create a backup with a random filename."""
-    dbx = dropbox.Dropbox(db_token)
-    with open(file_path, 'rb') as file:
+        root = None if GUILD_PARTITIONS else asyncio.create_task(partitions.get(None))
         try:
-            # Save to primary path
-            dbx.files_upload(file.read(), dropbox_path, mode=dropbox.files.WriteMode("overwrite"))
-            print(f"File uploaded successfully to {dropbox_path}")
-        except dropbox.exceptions.ApiError as e:
-            print(f"Dropbox API error for {dropbox_path}: {e}")
-        
-        # Create a backup with a random filename
-        random_backup_path = f"/{generate_random_filename()}_{dropbox_path[1::]}"
-        file.seek(0)  # Reset file pointer to the beginning
-        try:
-            dbx.files_upload(file.read(), random_backup_path, mode=dropbox.files.WriteMode("overwrite"))
-            print(f"Backup file uploaded successfully to {random_backup_path}")
-        except dropbox.exceptions.ApiError as e:
-            print(f"Dropbox API error for backup {random_backup_path}: {e}")
-
-def get_user_log_file(user_id):
-    return f"{user_id}_logs.csv"
+            await dropbox_sync.connect()
+        finally:
+            dropbox_connected.set()
+        startup_timer.mark("Dropbox token refreshed")
+        if root is not None:
+            await root
+            startup_timer.mark("progress and log history loaded")
+    finally:
+        data_ready.set()
+
+def partition_key(guild_id):
+    """Which partition serves a guild: its own with GUILD_PARTITIONS=1, otherwise (and for DMs) the root one."""
+    if not GUILD_PARTITIONS or guild_id is None or guild_id == LEGACY_GUILD_ID:
+        return None
+    return guild_id
+
+def partition_directory(key):
+    return os.path.join("guilds", str(key))
+
+def make_partition(key):
+    if key is None:
+        # The original single-cohort layout: files in the working directory, backups at the Dropbox root
+        directory, dropbox_prefix, db_path = ".", "", os.getenv("PROGRESS_DB", "progress.db")
+    else:
+        directory, dropbox_prefix, db_path = partition_directory(key), f"/guilds/{key}", "progress.db"
+    return Partition(
+        key, directory, dropbox_prefix, DEFAULT_MODULES, dropbox_sync, upload_scheduler, dropbox_connected,
+        db_path=db_path, journal_fsync=JOURNAL_FSYNC,
+    )
 
-def append_to_user_log(user_id, date, sheet_number, module, progress, comment):
-    log_file = get_user_log_file(user_id)
-    is_new_file = not os.path.exists(log_file)
-    
-    with open(log_file, mode='a', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        if is_new_file:
-            writer.writerow(["Date", "Sheet Number", "Module", "Progress", "Comment"])
-        writer.writerow([date, sheet_number, module, progress, comment])
-
-def save_user_logs(user_id, username):
-    """Save the user's logs to Dropbox using their username."""
-    log_file = get_user_log_file(user_id)
-    if os.path.exists(log_file):
-        dropbox_path = f"/{username}.csv"  # Dropbox path based on username
+async def get_partition(guild_id):
+    """The loaded partition for a guild (None for DMs), loading it on first use."""
+    await data_ready.wait()
+    return await partitions.get(partition_key(guild_id))
+
+def partition_modules(guild_id):
+    """Module names for autocomplete, without waiting for the guild's partition to load.
+
+    An unloaded (or evicted) guild's list is read from its modules.json. A guild
+    with no local directory yet may only have its list in Dropbox: its partition
+    starts loading and nothing is suggested until the list is known.
+    """
+    key = partition_key(guild_id)
+    partition = partitions.peek(key)
+    if partition is not None:
+        return partition.modules
+    if key is None:
+        return DEFAULT_MODULES
+    directory = partition_directory(key)
+    if not os.path.isdir(directory) or key in partitions.loading:
+        # The directory (and its modules.json) may still be on its way from Dropbox
+        if data_ready.is_set():
+            partitions.prefetch(key)
+        return []
+    return read_module_list(directory) or DEFAULT_MODULES
+
+def parse_bulk_log(text, default_sheet, modules):
+    """Parse "module:progress, sheet/module:progress, ..." into (sheet, module, progress) updates.
+
+    Raises ValueError with a message for the user if any pair is invalid.
+    """
+    module_names = {module.lower(): module for module in modules}
+    updates = []
+    for pair in text.split(","):
+        if not pair.strip():
+            continue
+        target, separator, progress = pair.rpartition(":")
+        # Module names may contain "/" themselves: only a numeric prefix is a sheet number
+        sheet, module = "", module_names.get(target.strip().lower())
+        prefix, slash, name = target.partition("/")
+        if module is None and slash and prefix.strip().isdigit():
+            sheet, module = prefix, module_names.get(name.strip().lower())
+        sheet = sheet.strip() or str(default_sheet)
+        if not separator or module is None:
+            raise ValueError(f"Couldn't read `{pair.strip()}`. Use `module:progress`, e.g. `Analysis 2:40`. "
+                             f"Modules: {', '.join(modules)}")
         try:
-            save_to_dropbox(log_file, dropbox_path, db_token)
-        except:
-            db_token = refresh_access_token()
-            save_to_dropbox(log_file, dropbox_path, db_token)
-    else:
-        print(f"No logs found for user_id {user_id}, skipping Dropbox upload.")
-
-def save_progress_data():
-    with open("progress_data.json", "w") as file:
-        json.dump(progress_data, file)
-
-def generate_random_filename():
-    """Generate a random 20-character string for backup filenames."""
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=20))
-
-def update_progress(user_id, week, module, progress, comment):
-    week = str(week)
-    if user_id not in progress_data:
-        progress_data[user_id] = {}
-    if week not in progress_data[user_id]:
-        progress_data[user_id][week] = {m: 0 for m in modules}
-    
-    current_progress = progress_data[user_id][week].get(module, 0)
-    new_progress = min(current_progress + progress, 100)
-    new_progress = max(new_progress, 0)
-    progress_data[user_id][week][module] = new_progress
-    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"Logged progress: {progress}")
-    print(f"new_progress = {new_progress}")
-    print(f"current_progress = {current_progress}")
-    print(f"new_progress - current_progress = {new_progress - current_progress}")
-    append_to_user_log(user_id, date, week, module, new_progress - current_progress, comment)
-
-def get_user_progress(user_id):
-    print(progress_data)
-    print([type(userid) for userid in progress_data.keys()])
-    return progress_data.get(user_id, {})
-
-def generate_html_table(user_id, weeks, selected_modules):
-    user_progress = get_user_progress(user_id)
+            sheet = str(int(sheet))
+            progress = float(progress)
+        except ValueError:
+            raise ValueError(f"Couldn't read `{pair.strip()}`: the sheet and progress must be numbers.") from None
+        if not math.isfinite(progress) or progress > 100:
+            raise ValueError("Progress must be between 0 and 100!")
+        updates.append((sheet, module, progress))
+    if not updates:
+        raise ValueError("Nothing to log. Use `module:progress` pairs, e.g. `Analysis 2:40, Groups and Rings:25`.")
+    if len(updates) > MAX_BULK_LOG_ENTRIES:
+        raise ValueError(f"You can log at most {MAX_BULK_LOG_ENTRIES} entries at once.")
+    return updates
+
+async def generate_html_table(partition, user_id, weeks, selected_modules):
+    from heatmap import render_heatmap_html
+    user_progress = partition.get_user_progress(user_id)
     data = []
     for week in weeks:
         row = [
@@ -142,54 +196,57 @@ def generate_html_table(user_id, weeks, selected_modules):
         ]
         data.append(row)
 
-    # Create a DataFrame
-    df = pd.DataFrame(data, index=weeks, columns=selected_modules)
-
-    # Round values to the nearest integer
-    df = df.round(0).astype(int)
-
-    # Generate heatmap HTML
-    template = Template(
-        """
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <style>
-                table {
-                    border-collapse: collapse;
-                    width: 100%;
-                }
-                th, td {
-                    border: 1px solid black;
-                    text-align: center;
-                    padding: 8px;
-                }
-            </style>
-        </head>
-        <body>
-            <h2>Progress Heatmap</h2>
-            {{ table_html }}
-        </body>
-        </html>
-        """
+    key = ("heatmap", partition.key, user_id, tuple(weeks), tuple(selected_modules))
+    return await chart_renderer.render(
+        key, partition.data_version, render_heatmap_html, data, weeks, selected_modules, in_process=False
     )
-    styled_table = df.style.background_gradient(cmap="coolwarm_r", axis=None)
-    table_html = styled_table.to_html()
-    return template.render(table_html=table_html)
 
 async def save_periodically():
     while True:
         await asyncio.sleep(86400)  # Wait for 24 hours
-        save_progress_data()  # Save data
-        try:
-            save_to_dropbox("progress_data.json", "/progress_data.json", db_token)
-        except:
-            db_token = refresh_access_token()
-            save_to_dropbox("progress_data.json", "/progress_data.json", db_token)
-        print("Progress data saved.")
-
-load_progress_data()
-modules = [
+        partitions.save_all()  # Save data
+        logger.info("Progress data saved")
+
+async def prune_snapshots_periodically():
+    while True:
+        await asyncio.sleep(3600)  # Snapshot retention works in hourly steps
+        await dropbox_sync.prune_snapshots()
+
+async def evict_partitions_periodically():
+    while True:
+        await asyncio.sleep(min(PARTITION_IDLE_TIMEOUT, 300))
+        partitions.evict_idle()
+
+# fsync every journal append (set JOURNAL_FSYNC=0 to trade crash safety for throughput)
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "1") != "0"
+# GUILD_PARTITIONS=1 gives each guild its own modules, progress, logs and Dropbox prefix (see guild_partitions.py).
+# LEGACY_GUILD_ID keeps one guild on the root partition, i.e. the data of a single-cohort deployment.
+GUILD_PARTITIONS = os.getenv("GUILD_PARTITIONS", "0") == "1"
+LEGACY_GUILD_ID = int(os.getenv("LEGACY_GUILD_ID", "0")) or None
+# Guild partitions unused for this many seconds are saved and closed
+PARTITION_IDLE_TIMEOUT = float(os.getenv("PARTITION_IDLE_TIMEOUT", "3600"))
+partitions = Partitions(make_partition, idle_timeout=PARTITION_IDLE_TIMEOUT)
+# User names are shared by every partition, so they live in the root database
+user_names = UserNameCache(bot, ProgressStore(os.getenv("PROGRESS_DB", "progress.db")))
+chart_renderer = ChartRenderer()
+metrics.gauge("dropbox_queue_depth", lambda: dropbox_sync.queue.qsize())
+metrics.gauge("dropbox_uploads_pending", lambda: len(upload_scheduler.dirty))
+metrics.gauge("journal_entries_pending", lambda: sum(len(p.pending_journal_seqs) for p in partitions.loaded.values()))
+metrics.gauge("chart_cache_entries", lambda: len(chart_renderer.cache))
+metrics.gauge("partitions_loaded", lambda: len(partitions.loaded))
+metrics.gauge("users_tracked", lambda: sum(len(p.progress_table) for p in partitions.loaded.values()))
+# Longer leaderboards don't fit in a single Discord message anyway
+LEADERBOARD_SIZE = 50
+# Most updates one /logmany can apply
+MAX_BULK_LOG_ENTRIES = 25
+# Attachment size limit outside servers; in a server, Guild.filesize_limit (higher with boosts) is used
+DISCORD_FILE_LIMIT = 25 * 1024 * 1024
+# /leaderboard shows this many users per page, with buttons for the rest
+LEADERBOARD_PAGE_SIZE = 20
+# Points per user on a /race chart, however long the history; the chart is 1000 pixels wide
+RACE_MAX_POINTS = 500
+# Modules of the root partition, and of a guild partition until /setmodules changes them
+DEFAULT_MODULES = [
     "Analysis 2",
     "Linear Algebra and Numerical Analysis",
     "Multivariable Calculus and Differential Equations",
@@ -204,48 +261,41 @@ modules = [
 
 # Commands
 @bot.command()
+@metrics.timed("command_seconds", command="!log")
 async def log(ctx, sheet_number: int, module: str, progress: float):
+    partition = await get_partition(ctx.guild.id if ctx.guild else None)
     sheet_number = str(sheet_number)
-    if module not in modules:
-        await ctx.send(f"Invalid module. Choose from: {', '.join(modules)}")
+    if module not in partition.modules:
+        await ctx.send(f"Invalid module. Choose from: {', '.join(partition.modules)}")
         return
 
     # Check if progress is between 0 and 100
-    if progress > 100:
+    if not math.isfinite(progress) or progress > 100:
         await ctx.send("Progress must be between 0 and 100!")
         return
     
-    update_progress(ctx.author.id, sheet_number, module, progress)
+    await partition.update_progress(ctx.author.id, sheet_number, module, progress, "")
     await ctx.send(f"Progress updated for {ctx.author.name}: Sheet number {sheet_number}, {module}, +{progress}%!")
 
 @bot.command()
+@metrics.timed("command_seconds", command="!leaderboard")
 async def leaderboard(ctx, sheet_number: int):
+    partition = await get_partition(ctx.guild.id if ctx.guild else None)
     sheet_number = str(sheet_number)
-    save_progress_data() # Remove later
-    try:
-        save_to_dropbox("progress_data.json", "/progress_data.json", db_token) # Remove later
-    except:
-        db_token = refresh_access_token()
-        save_to_dropbox("progress_data.json", "/progress_data.json", db_token) # Remove later 
-    leaderboard = []
-    print(progress_data)
-
-    for user_id, user_data in progress_data.items():
-        total_progress = sum(user_data.get(sheet_number, {}).values())
-        leaderboard.append((user_id, total_progress))
-
-    leaderboard.sort(key=lambda x: x[1], reverse=True)
-    print(leaderboard)
+    partition.save() # Remove later
+    leaderboard = partition.leaderboard_index.top(sheet=sheet_number, k=LEADERBOARD_SIZE)
+    names = await user_names.resolve([user_id for user_id, _ in leaderboard])
     leaderboard_message = "Leaderboard:\n"
     for rank, (user_id, total) in enumerate(leaderboard, start=1):
-        user = await bot.fetch_user(user_id)
-        leaderboard_message += f"{rank}. {user.name} - {total}\n"
+        leaderboard_message += f"{rank}. {names[user_id][0]} - {total}\n"
 
     await ctx.send(f"```{leaderboard_message}```")
 
 @bot.command()
+@metrics.timed("command_seconds", command="!myprogress")
 async def myprogress(ctx):
-    progress = get_user_progress(ctx.author.id)
+    partition = await get_partition(ctx.guild.id if ctx.guild else None)
+    progress = partition.get_user_progress(ctx.author.id)
     progress_message = "Your Progress:\n"
 
     for sheet_number, modules_progress in progress.items():
@@ -256,7 +306,9 @@ async def myprogress(ctx):
     await ctx.send(f"```{progress_message}```")
 
 @bot.command()
+@metrics.timed("command_seconds", command="!export")
 async def export(ctx, sheets: str, modules: str = None):
+    partition = await get_partition(ctx.guild.id if ctx.guild else None)
     user_id = ctx.author.id
     try:
         sheets = [sheet.strip() for sheet in sheets.split(",")]
@@ -271,21 +323,19 @@ async def export(ctx, sheets: str, modules: str = None):
     )
     if selected_modules:
         for module in selected_modules:
-            if module not in modules:
+            if module not in partition.modules:
                 await ctx.send(
-                    f"Invalid module: {module}. Choose from: {', '.join(modules)}"
+                    f"Invalid module: {module}. Choose from: {', '.join(partition.modules)}"
                 )
                 return
     else:
-        selected_modules = modules  # Default to all modules
+        selected_modules = partition.modules  # Default to all modules
 
     try:
-        html_content = generate_html_table(user_id, sheets, selected_modules)
-        with open("progress.html", "w") as f:
-            f.write(html_content)
-        await ctx.send(file=discord.File("progress.html"))
-    except Exception as e:
-        print(f"Error exporting progress: {e}")
+        html_content = await generate_html_table(partition, user_id, sheets, selected_modules)
+        await ctx.send(file=discord.File(fp=BytesIO(html_content), filename="progress.html"))
+    except Exception:
+        logger.exception("Error exporting progress")
         await ctx.send("Failed to export progress. Please try again.")
 
 @bot.tree.command(name="log", description="Log your progress on a problem sheet")
@@ -294,86 +344,87 @@ async def export(ctx, sheets: str, modules: str = None):
     module="The module you're working on (choose from options)",
     progress="The percentage of progress you made"
 )
+@metrics.timed("command_seconds", command="log")
 async def log(interaction: discord.Interaction, sheet_number: int, module: str, progress: float, comment: str = ""):
+    # Acknowledge within Discord's 3 second limit; loading an evicted partition can take longer
+    await interaction.response.defer(thinking=True)
+    partition = await get_partition(interaction.guild_id)
     sheet_number = str(sheet_number)
-    if module not in modules:
-        await interaction.response.send_message(f"Invalid module. Choose from: {', '.join(modules)}")
+    if module not in partition.modules:
+        await interaction.followup.send(f"Invalid module. Choose from: {', '.join(partition.modules)}")
         return
 
-    update_progress(interaction.user.id, sheet_number, module, progress, comment)
-    save_user_logs(interaction.user.id, interaction.user.name)
-    await interaction.response.send_message(f"Progress updated for {interaction.user.name}: Sheet {sheet_number}, {module}, +{progress}%!\n\n{comment}")
+    await partition.update_progress(interaction.user.id, sheet_number, module, progress, comment)
+    partition.save_user_logs(interaction.user.id, interaction.user.name)
+    await interaction.followup.send(f"Progress updated for {interaction.user.name}: Sheet {sheet_number}, {module}, +{progress}%!\n\n{comment}")
 
 @log.autocomplete('module')
 async def module_autocomplete(interaction: discord.Interaction, current: str):
     return [
         app_commands.Choice(name=module, value=module)
-        for module in modules if current.lower() in module.lower()
+        for module in partition_modules(interaction.guild_id) if current.lower() in module.lower()
     ]
 
+@bot.tree.command(name="logmany", description="Log progress on several modules or sheets at once")
+@app_commands.describe(
+    sheet_number="The sheet number for entries that don't name one",
+    entries="module:progress pairs, e.g. Analysis 2:40, 3/Groups and Rings:25 (the sheet/ prefix is optional)",
+)
+@metrics.timed("command_seconds", command="logmany")
+async def logmany(interaction: discord.Interaction, sheet_number: int, entries: str, comment: str = ""):
+    # Acknowledge within Discord's 3 second limit; loading an evicted partition can take longer
+    await interaction.response.defer(thinking=True)
+    partition = await get_partition(interaction.guild_id)
+    try:
+        updates = parse_bulk_log(entries, sheet_number, partition.modules)
+    except ValueError as e:
+        await interaction.followup.send(str(e))
+        return
+
+    # One journal write, one store transaction, one CSV append and one upload for the whole batch
+    await partition.update_progress_many(interaction.user.id, updates, comment)
+    partition.save_user_logs(interaction.user.id, interaction.user.name)
+    lines = "\n".join(f"Sheet {sheet}, {module}, +{progress}%" for sheet, module, progress in updates)
+    await interaction.followup.send(f"Progress updated for {interaction.user.name}:\n{lines}\n\n{comment}")
+
 @bot.tree.command(name="leaderboard", description="See the problem sheet leaderboards")
 @app_commands.describe(
     sheet_number="The sheet number (e.g., 1, 2, 3)",
     module="The module to filter by (choose from options)"
 )
+@metrics.timed("command_seconds", command="leaderboard")
 async def leaderboard(interaction: discord.Interaction, sheet_number: int = None, module: str = None):
+    # Acknowledge within Discord's 3 second limit; the page is sent as a followup
+    await interaction.response.defer(thinking=True)
+    partition = await get_partition(interaction.guild_id)
     leaderboard_prefix = ""
     if sheet_number:
         sheet_number = str(sheet_number)
         leaderboard_prefix += "Sheet " + sheet_number + ' '
     if module:
         leaderboard_prefix += module + ' '
-    leaderboard = []
-    
-
-    if module and (module not in modules):
-        await interaction.response.send_message(
-            f"Invalid module. Choose from: {', '.join(modules)}"
+    if module and (module not in partition.modules):
+        await interaction.followup.send(
+            f"Invalid module. Choose from: {', '.join(partition.modules)}"
         )
         return
 
-    # Calculate leaderboard
-    for user_id, user_data in progress_data.items():
-        if sheet_number:
-            print(f"We have sheet_number: sheet_number = {sheet_number}") # Remove later
-        if module:
-            print(f"We have module: module = {module}")
-        if sheet_number is None:
-            print("sheet_number is None")
-
-        if sheet_number and module:  # Specific sheet and module
-            total_points = user_data.get(sheet_number, {}).get(module, 0)
-        elif sheet_number:  # Specific sheet
-            total_points = sum(user_data.get(sheet_number, {}).values())
-        elif module:  # Specific module
-            print(progress_data) # Remove later
-            print([sheet_data.get(module, 0) for sheet_data in user_data.values()]) # Remove later
-            total_points = sum(
-                sheet_data.get(module, 0) for sheet_data in user_data.values()
-            )
-        else:  # All sheets and modules
-            total_points = sum(
-                module_points for sheet_data in user_data.values() for module_points in sheet_data.values()
-            )
-
-        leaderboard.append((user_id, total_points))
-
-    # Sort leaderboard by total points
-    leaderboard.sort(key=lambda x: x[1], reverse=True)
-
-    # Format leaderboard message
-    leaderboard_message = leaderboard_prefix + "Leaderboard:\n"
-    for rank, (user_id, total) in enumerate(leaderboard, start=1):
-        user = await bot.fetch_user(user_id)
-        leaderboard_message += f"{rank}. {user.name} - {total}\n"
-
-    await interaction.response.send_message(f"```{leaderboard_message}```")
+    # Pages are slices of the already sorted index; only the shown page's names are resolved
+    pages = LeaderboardPages(
+        partition.leaderboard_index, user_names, sheet=sheet_number or None, module=module or None,
+        title=leaderboard_prefix + "Leaderboard:", page_size=LEADERBOARD_PAGE_SIZE,
+    )
+    content = await pages.render()
+    if pages.page_count == 1:
+        await interaction.followup.send(content)
+        return
+    pages.message = await interaction.followup.send(content, view=pages, wait=True)
 
 @leaderboard.autocomplete('module')
 async def module_autocomplete(interaction: discord.Interaction, current: str):
     return [
         app_commands.Choice(name=module, value=module)
-        for module in modules if current.lower() in module.lower()
+        for module in partition_modules(interaction.guild_id) if current.lower() in module.lower()
     ]
 
 @bot.tree.command(name="export", description="Export your progress as an HTML table")
@@ -381,17 +432,20 @@ async def module_autocomplete(interaction: discord.Interaction, current: str):
     sheets="Comma-separated list of sheet numbers (optional, defaults to all sheets you've logged)",
     selected_modules="Comma-separated list of modules (optional, defaults to logged modules)"
 )
+@metrics.timed("command_seconds", command="export")
 async def export(interaction: discord.Interaction, sheets: str = "", selected_modules: str = ""):
+    await interaction.response.defer(thinking=True)
+    partition = await get_partition(interaction.guild_id)
     user_id = interaction.user.id
 
     # Get user's progress data
-    user_progress = get_user_progress(user_id)
+    user_progress = partition.get_user_progress(user_id)
 
     # Infer all sheets if none are provided
     if not sheets.strip():
         sheets = list(user_progress.keys())
         if not sheets:
-            await interaction.response.send_message(
+            await interaction.followup.send(
                 "You have no progress logged, so there's nothing to export."
             )
             return
@@ -399,7 +453,7 @@ async def export(interaction: discord.Interaction, sheets: str = "", selected_mo
         try:
             sheets = [sheet.strip() for sheet in sheets.split(",")]
         except ValueError:
-            await interaction.response.send_message(
+            await interaction.followup.send(
                 "Invalid sheet numbers format. Use a comma-separated list, e.g., `1,2,3`."
             )
             return
@@ -414,48 +468,89 @@ async def export(interaction: discord.Interaction, sheets: str = "", selected_mo
             if progress > 0
         })
         if not selected_modules:
-            await interaction.response.send_message(
+            await interaction.followup.send(
                 "You have no progress logged for any modules, so there's nothing to export."
             )
             return
     else:
         selected_modules = [module.strip() for module in selected_modules.split(",")]
         for module in selected_modules:
-            if module not in modules:
-                await interaction.response.send_message(
-                    f"Invalid module: {module}. Choose from: {', '.join(modules)}"
+            if module not in partition.modules:
+                await interaction.followup.send(
+                    f"Invalid module: {module}. Choose from: {', '.join(partition.modules)}"
                 )
                 return
 
     # Generate and send HTML table
     try:
-        html_content = generate_html_table(user_id, sheets, selected_modules)
-        with open("progress.html", "w") as f:
-            f.write(html_content)
+        html_content = await generate_html_table(partition, user_id, sheets, selected_modules)
 
-        await interaction.response.send_message(
+        await interaction.followup.send(
             "Here's your exported progress!",
-            file=discord.File("progress.html")
+            file=discord.File(fp=BytesIO(html_content), filename="progress.html")
         )
-    except Exception as e:
-        print(f"Error exporting progress: {e}")
-        await interaction.response.send_message(
+    except Exception:
+        logger.exception("Error exporting progress")
+        await interaction.followup.send(
             "Failed to export progress. Please try again."
         )
 
-@bot.tree.command(name="alllogs", description="Export all of your logs as a CSV file")
-async def alllogs(interaction: discord.Interaction):
+@bot.tree.command(name="alllogs", description="Export your logs as a CSV, gzipped CSV or Parquet file")
+@app_commands.describe(
+    sheets="Only these sheet numbers (comma separated)",
+    module="Only this module (choose from options)",
+    start_date="Only logs from this date onwards (YYYY-MM-DD)",
+    end_date="Only logs up to and including this date (YYYY-MM-DD)",
+    file_format="File format (default csv)"
+)
+@app_commands.choices(file_format=[app_commands.Choice(name=fmt, value=fmt) for fmt in FORMATS])
+@metrics.timed("command_seconds", command="alllogs")
+async def alllogs(
+    interaction: discord.Interaction, sheets: str = "", module: str = None,
+    start_date: str = None, end_date: str = None, file_format: str = "csv",
+):
     user_id = interaction.user.id
-    log_file = get_user_log_file(user_id)
+    try:
+        start = datetime.fromisoformat(start_date) if start_date else None
+        end = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        await interaction.response.send_message("Invalid date format. Please use YYYY-MM-DD.", ephemeral=True)
+        return
+    if end_date and len(end_date) == len("YYYY-MM-DD"):
+        end += timedelta(days=1, seconds=-1)  # the whole end day
+    await interaction.response.defer(thinking=True)
 
+    partition = await get_partition(interaction.guild_id)
+    log_file = partition.get_user_log_file(user_id)
     if not os.path.exists(log_file):
-        await interaction.response.send_message("You have no logs to export.")
+        await interaction.followup.send("You have no logs to export.")
         return
 
-    await interaction.response.send_message(
-        "Here are all your logs!",
-        file=discord.File(log_file)
-    )
+    # Rows stream from the CSV into one attachment-sized chunk at a time, built on a worker thread
+    sheets = {sheet.strip() for sheet in sheets.split(",") if sheet.strip()}
+    rows = iter_log_rows(log_file, sheets=sheets, module=module, start=start, end=end)
+    limit = interaction.guild.filesize_limit if interaction.guild else DISCORD_FILE_LIMIT
+    first_message = "Here are your matching logs!" if sheets or module or start or end else "Here are all your logs!"
+    parts = 0
+    try:
+        chunks = export_chunks(rows, file_format, limit)
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            parts += 1
+            name = f"{user_id}_logs" + (f"_part{parts}" if parts > 1 else "")
+            message = first_message if parts == 1 else f"Part {parts}"
+            await interaction.followup.send(message, file=discord.File(fp=BytesIO(chunk), filename=f"{name}.{file_format}"))
+    except ExportError as e:
+        await interaction.followup.send(str(e))
+        return
+    if not parts:
+        await interaction.followup.send("None of your logs match those filters.")
+
+@alllogs.autocomplete('module')
+async def module_autocomplete(interaction: discord.Interaction, current: str):
+    return [
+        app_commands.Choice(name=module, value=module)
+        for module in partition_modules(interaction.guild_id) if current.lower() in module.lower()
+    ]
 
 @bot.tree.command(name="race", description="Show progress race across users with a line graph.")
 @app_commands.describe(
@@ -463,121 +558,103 @@ async def alllogs(interaction: discord.Interaction):
     module="Filter by module (choose from options)",
     start_date="Filter data from this date onwards (YYYY-MM-DD)"
 )
+@metrics.timed("command_seconds", command="race")
 async def race(interaction: discord.Interaction, sheets: str = "", module: str = None, start_date: str = None):
-    # Convert sheets input into a list
-    sheets = [sheet.strip() for sheet in sheets.split(',')] if sheets else None
-
-    # Parse start_date
+    # Parse start_date before deferring, so the error can still be ephemeral
     if start_date:
         try:
-            start_date = pd.to_datetime(start_date)
+            start_date = datetime.fromisoformat(start_date)
         except ValueError:
             await interaction.response.send_message("Invalid `start_date` format. Please use YYYY-MM-DD.", ephemeral=True)
             return
 
-    # Initialize a dictionary to store user progress over time
-    user_data = {}
-
-    # Get the current time for the end dummy point
-    current_time = datetime.now()
-
-    # Loop through all CSV files in the directory
-    for file in os.listdir():
-        if file.endswith(".csv"):
-            user_id = os.path.splitext(file)[0].partition('_')[0]  # Extract user ID from file name
-
-            try:
-                # Read the CSV file
-                df = pd.read_csv(file)
-
-                # Filter by sheet and/or module if applicable
-                if sheets:
-                    df = df[df["Sheet Number"].astype(str).isin(sheets)]
-                if module:
-                    df = df[df["Module"] == module]
-
-                # Ensure 'Date' is datetime and filter by start_date if provided
-                df["Date"] = pd.to_datetime(df["Date"])
-                if start_date:
-                    df = df[df["Date"] >= start_date]
-
-                # Group progress by date
-                df = df.groupby("Date")["Progress"].sum().cumsum().reset_index()
-
-                # Add dummy point for the start (progress=0 at the first log time)
-                start_time = df["Date"].min()
-                if not start_time:
-                    continue  # Skip if there's no valid data after filtering
-                df = pd.concat([
-                    pd.DataFrame({"Date": [start_time], "Progress": [0]}),
-                    df
-                ], ignore_index=True)
-
-                # Add dummy point for the end (progress=cumulative progress at current time)
-                current_progress = df["Progress"].iloc[-1]
-                df = pd.concat([
-                    df,
-                    pd.DataFrame({"Date": [current_time], "Progress": [current_progress]})
-                ], ignore_index=True)
-
-                # Store user progress
-                user_data[user_id] = df
-            except Exception as e:
-                print(f"Error reading file {file}: {e}")
-
-    # Plotting the data
-    plt.figure(figsize=(10, 6))
-    for user_id, df in user_data.items():
-        # Fetch user's display name
-        user = await bot.fetch_user(int(user_id))
-        display_name = user.display_name if user else user_id
-
-        # Plot the user's progress
-        plt.plot(df["Date"], df["Progress"], label=display_name)
-
-    plt.title("Progress Race")
-    plt.xlabel("Date")
-    plt.ylabel("Cumulative Progress (%)")
-
-    # Set x-axis ticks to display daily labels
-    plt.gca().xaxis.set_major_locator(mdates.DayLocator())  # Display every day
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%b %d, %Y'))  # Format as 'Jan 01, 2022'
-    plt.xticks(rotation=45)  # Rotate labels to avoid overlap
-
-    plt.tight_layout()
-
-    plt.legend(title="Users")
-    plt.grid()
-
-    # Save plot to a BytesIO object
-    buffer = BytesIO()
-    plt.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    # Rendering can take longer than Discord's 3 second limit for a first response
+    await interaction.response.defer(thinking=True)
+    partition = await get_partition(interaction.guild_id)
+    # Convert sheets input into a list
+    sheets = [sheet.strip() for sheet in sheets.split(',')] if sheets else None
+
+    # Cumulative progress per user, with dummy start/end points, straight from memory
+    # Long histories come from the hourly/daily/weekly rollups, downsampled to RACE_MAX_POINTS per user
+    user_data = partition.race_series.query(
+        sheets=sheets, module=module, start_date=start_date, end_time=datetime.now(), max_points=RACE_MAX_POINTS
+    )
+
+    # Render the chart in a worker process (or reuse it if nothing was logged since)
+    names = await user_names.resolve(list(user_data))
+    series = [(names[user_id][1], dates, cumulative_progress) for user_id, (dates, cumulative_progress) in user_data.items()]
+    key = ("race", partition.key, tuple(sheets or ()), module, start_date, tuple(label for label, _, _ in series))
+    png = await chart_renderer.render(key, partition.data_version, render_race_png, series)
 
     # Send the image
-    await interaction.response.send_message(file=discord.File(fp=buffer, filename="progress_race.png"))
+    await interaction.followup.send(file=discord.File(fp=BytesIO(png), filename="progress_race.png"))
 
 @race.autocomplete('module')
 async def module_autocomplete(interaction: discord.Interaction, current: str):
     return [
         app_commands.Choice(name=module, value=module)
-        for module in modules if current.lower() in module.lower()
+        for module in partition_modules(interaction.guild_id) if current.lower() in module.lower()
     ]
 
+@bot.tree.command(name="stats", description="Show pace, streaks, module forecasts and cohort percentiles")
+@app_commands.describe(user="Whose stats to show (defaults to you)")
+@metrics.timed("command_seconds", command="stats")
+async def stats(interaction: discord.Interaction, user: discord.User = None):
+    # Acknowledge within Discord's 3 second limit; loading an evicted partition can take longer
+    await interaction.response.defer(thinking=True)
+    partition = await get_partition(interaction.guild_id)
+    user = user or interaction.user
+    # Computed over every log at once, then reused until someone logs progress
+    summary = partition.cohort_stats(date.today()).summary(user.id, user.name)
+    if summary is None:
+        await interaction.followup.send(f"{user.name} has no logs yet.")
+        return
+    await interaction.followup.send(f"```{summary[:1990]}```")
+
+@bot.tree.command(name="setmodules", description="Set the modules this server logs progress on")
+@app_commands.describe(module_names="Comma-separated list of modules")
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+@metrics.timed("command_seconds", command="setmodules")
+async def setmodules(interaction: discord.Interaction, module_names: str):
+    if partition_key(interaction.guild_id) is None:
+        await interaction.response.send_message(
+            "This server uses the shared module list, which can't be changed from Discord.", ephemeral=True
+        )
+        return
+    names = list(dict.fromkeys(name.strip() for name in module_names.split(",") if name.strip()))
+    if not names:
+        await interaction.response.send_message("Give at least one module name.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    partition = await get_partition(interaction.guild_id)
+    partition.set_modules(names)
+    await interaction.followup.send(f"Modules set to: {', '.join(names)}", ephemeral=True)
+
+@bot.tree.command(name="botstats", description="Show the bot's command latencies, queues and caches")
+@app_commands.default_permissions(administrator=True)
+async def botstats(interaction: discord.Interaction):
+    await interaction.response.send_message(f"```{metrics.summary()[:1990]}```", ephemeral=True)
+
 @bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user}")
-    # Sync commands with Discord
-    await bot.tree.sync()
-    try:
-        load_from_dropbox("/progress_data.json", "progress_data.json", db_token)
-    except:
-        db_token = refresh_access_token()
-        load_from_dropbox("/progress_data.json", "progress_data.json", db_token) 
-    load_progress_data()
-    print("Commands synced.")
-    bot.loop.create_task(save_periodically())
+    logger.info("Logged in as %s", bot.user)
+    startup_timer.mark("gateway ready")
+    # Sync commands with Discord, from one process when the shards are split across several
+    if SHARDS is None or SHARDS[1] is None or 0 in SHARDS[1]:
+        await bot.tree.sync()
+        logger.info("Commands synced")
+        startup_timer.mark("commands synced")
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    if not startup_timer.reported:
+        startup_timer.mark(f"first interaction served (/{command.name})")
+        startup_timer.report()
 
 # Run the bot
-bot.run(token)
+if SHARDS:
+    # Refuse to start rather than let two processes write the same partition
+    check_shard_layout(*SHARDS, GUILD_PARTITIONS, LEGACY_GUILD_ID)
+# Keep the logging configured above instead of discord.py's default handler
+bot.run(token, log_handler=None)
@@ -0,0 +1,24 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Records how long each startup step took, measured from when the timer was created."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self.reported = False
+
+    def mark(self, step):
+        self.marks.append((step, time.perf_counter() - self.start))
+
+    def report(self):
+        """Log the timings once, e.g. after the first interaction has been served."""
+        if self.reported:
+            return
+        self.reported = True
+        lines = [f"  {elapsed * 1000:8.1f} ms  {step}" for step, elapsed in self.marks]
+        logger.info("Startup timing:\n%s", "\n".join(lines))
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import discord
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UserNameCache:
+    """Resolves user IDs to (name, display_name), avoiding one REST call per user.
+
+    Lookups try, in order: this cache (LRU with a TTL), the gateway's user cache,
+    then concurrent fetch_user calls limited to `concurrency` at a time. Resolved
+    names are saved to the progress store so they survive restarts.
+    """
+
+    def __init__(self, bot, store, ttl=24 * 60 * 60, max_size=10000, concurrency=5):
+        self.bot = bot
+        self.store = store
+        self.ttl = ttl
+        self.max_size = max_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.names = OrderedDict()  # user_id -> (name, display_name, resolved_at)
+        for user_id, name, display_name, resolved_at in store.load_user_names():
+            self.names[user_id] = (name, display_name, resolved_at)
+        self._evict()
+
+    async def resolve(self, user_ids):
+        """Return {user_id: (name, display_name)} for every requested ID."""
+        now = time.time()
+        resolved = {}
+        missing = []
+        fresh = []
+        for user_id in dict.fromkeys(user_ids):
+            entry = self.names.get(user_id)
+            if entry and now - entry[2] < self.ttl:
+                self.names.move_to_end(user_id)
+                resolved[user_id] = entry[:2]
+                metrics.inc("user_name_cache_hits_total")
+                continue
+            metrics.inc("user_name_cache_misses_total")
+            user = self.bot.get_user(user_id)
+            if user is not None:
+                resolved[user_id] = self._remember(user_id, user, now, fresh)
+            else:
+                missing.append(user_id)
+
+        users = await asyncio.gather(*(self._fetch(user_id) for user_id in missing))
+        for user_id, user in zip(missing, users):
+            if user is not None:
+                resolved[user_id] = self._remember(user_id, user, now, fresh)
+            elif user_id in self.names:
+                # Keep showing the stale name rather than a bare ID
+                resolved[user_id] = self.names[user_id][:2]
+            else:
+                resolved[user_id] = (str(user_id), str(user_id))
+
+        if fresh:
+            self.store.save_user_names(fresh)
+        self._evict()
+        return resolved
+
+    async def _fetch(self, user_id):
+        async with self.semaphore:
+            try:
+                return await self.bot.fetch_user(user_id)
+            except discord.HTTPException as e:
+                logger.warning("Couldn't fetch user=%s error=%s", user_id, e)
+                return None
+
+    def _remember(self, user_id, user, now, fresh):
+        entry = (user.name, user.display_name, now)
+        fresh.append((user_id, *entry))
+        self.names[user_id] = entry
+        self.names.move_to_end(user_id)
+        return entry[:2]
+
+    def _evict(self):
+        while len(self.names) > self.max_size:
+            self.names.popitem(last=False)